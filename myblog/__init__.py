@@ -3,14 +3,25 @@ Created: 2023-11-20
 Author: Gao Tianchi
 """
 
-
 from flask import Flask
 
 from .command import regisiter_command
 from .config import get_config
 from .contexthelp import register_context_processor
-from .controller import bp_account, bp_auth, bp_author, bp_visitor
+from .controller import (
+    bp_account,
+    bp_api,
+    bp_auth,
+    bp_author,
+    bp_legacy_api,
+    bp_owner,
+    bp_visitor,
+)
 from .flaskexten import cors, db, mail
+from .jobqueue import init_app as init_jobqueue
+from .model.engine import apply_pragmas, emit_begin
+from .model.render import init_app as init_render_cache
+from .pagecache import init_app as init_page_cache
 
 
 def create_app(environment: str = None) -> Flask:
@@ -23,12 +34,21 @@ def create_app(environment: str = None) -> Flask:
     )
     app.config.from_object(config)
     db.init_app(app)
+    with app.app_context():
+        apply_pragmas(db.engine, app.config["SQLITE_PRAGMAS"])
+        emit_begin(db.engine)
     mail.init_app(app)
     cors.init_app(app)
+    init_jobqueue(app)
+    init_render_cache(app)
+    init_page_cache(app)
     app.register_blueprint(bp_auth)
     app.register_blueprint(bp_visitor)
+    app.register_blueprint(bp_api, name="api", url_prefix="/api")
+    app.register_blueprint(bp_legacy_api)
     app.register_blueprint(bp_account)
     app.register_blueprint(bp_author)
+    app.register_blueprint(bp_owner, url_prefix="/owner")
 
     regisiter_command(app)
     register_context_processor(app)
@@ -0,0 +1,145 @@
+"""
+Summary: Measure read throughput of the database while comments are written.
+Created: 2023-12-20
+Author: Gao Tianchi
+"""
+
+import logging
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.exc import OperationalError
+
+from .model.database import Comment, Post
+from .model.engine import apply_pragmas
+
+logger = logging.getLogger("root.benchmark")
+
+# What SQLite does without any tuning, for comparison.
+DEFAULT_PRAGMAS: dict[str, str | int] = dict(journal_mode="DELETE", synchronous="FULL")
+
+
+def copy_database(source: Path, target: Path) -> None:
+    # The backup API gives a consistent copy even while the app writes.
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def percentile(values: list[float], q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+def run(
+    database: Path,
+    pragmas: dict[str, str | int],
+    engine_options: dict,
+    readers: int,
+    writers: int,
+    duration: float,
+) -> dict:
+    """Read posts from reader threads while writer threads insert comments.
+
+    Runs against a copy of the database, so the real one is never written.
+    Returns the throughput and read latency in milliseconds.
+    """
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir).joinpath(database.name)
+        copy_database(database, path)
+
+        options = dict(engine_options)
+        options["pool_size"] = max(options.get("pool_size", 5), readers + writers)
+        engine = create_engine(f"sqlite:///{path}", **options)
+        apply_pragmas(engine, pragmas)
+
+        with engine.connect() as connection:
+            slugs: list[str] = list(connection.scalars(select(Post.slug)))
+        if not slugs:
+            engine.dispose()
+            raise ValueError("There are no posts to read.")
+
+        latencies: list[float] = []
+        counts = dict(reads=0, writes=0, errors=0)
+        lock = threading.Lock()
+        start = threading.Barrier(readers + writers + 1)
+        deadline = 0.0
+
+        def read() -> None:
+            own: list[float] = []
+            start.wait()
+            while time.perf_counter() < deadline:
+                began = time.perf_counter()
+                try:
+                    with engine.connect() as connection:
+                        connection.execute(
+                            select(Post.id, Post.title, Post.content).where(
+                                Post.slug == random.choice(slugs)
+                            )
+                        ).all()
+                except OperationalError:
+                    with lock:
+                        counts["errors"] += 1
+                    continue
+                own.append(time.perf_counter() - began)
+
+            with lock:
+                latencies.extend(own)
+                counts["reads"] += len(own)
+
+        def write() -> None:
+            written = 0
+            start.wait()
+            while time.perf_counter() < deadline:
+                try:
+                    with engine.begin() as connection:
+                        connection.execute(
+                            insert(Comment).values(
+                                content="benchmark", timestamp=datetime.now()
+                            )
+                        )
+                except OperationalError:
+                    with lock:
+                        counts["errors"] += 1
+                    continue
+                written += 1
+
+            with lock:
+                counts["writes"] += written
+
+        threads = [threading.Thread(target=read) for _ in range(readers)]
+        threads += [threading.Thread(target=write) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+
+        deadline = time.perf_counter() + duration
+        start.wait()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    latencies_ms = [latency * 1000 for latency in latencies]
+    return dict(
+        reads=counts["reads"],
+        writes=counts["writes"],
+        errors=counts["errors"],
+        reads_per_second=counts["reads"] / duration,
+        writes_per_second=counts["writes"] / duration,
+        p50=percentile(latencies_ms, 50),
+        p99=percentile(latencies_ms, 99),
+        max=max(latencies_ms, default=0.0),
+    )
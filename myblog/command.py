@@ -7,23 +7,76 @@ import logging
 import os
 import shutil
 import subprocess
+import time
 from pathlib import Path
 
 import click
 from flask import Flask, render_template
 
 from .flaskexten import db
+from .model.database import rebuild_search, recount, transaction
 from .model.fileitem import OwnerProfile
+from .model.migration import upgrade
+from .model.render import get_render_cache
+from .pagecache import get_page_cache
 
 logger = logging.getLogger("root.command")
 
 
 def regisiter_command(app: Flask):
-    @app.cli.command("initdb", help="Initialize the database.")
-    def initdb():
+    @app.cli.command("initdb", help="Create or upgrade the database schema.")
+    @click.option("--drop", is_flag=True, help="Drop all tables first.")
+    def initdb(drop: bool):
         db.session.rollback()
-        db.drop_all()
-        db.create_all()
+        if drop:
+            db.drop_all()
+
+        applied = upgrade()
+        for description in applied:
+            click.echo(description)
+        if not applied:
+            click.echo("The schema is up to date.")
+
+    @app.cli.command("recount", help="Repair post and comment counters.")
+    def recount_command():
+        with transaction():
+            fixed = recount()
+
+        for name, count in fixed.items():
+            click.echo(f"Fixed {count} {name} counters.")
+
+    @app.cli.command("rebuild-search", help="Rebuild the search index of posts.")
+    def rebuild_search_command():
+        with transaction():
+            count = rebuild_search()
+
+        click.echo(f"Indexed {count} published posts.")
+
+    @app.cli.command("explain", help="Show query plans of hot endpoints.")
+    @click.option("--endpoint", default=None, help="Only explain this endpoint.")
+    @click.option("--strict", is_flag=True, help="Fail if a query scans a table.")
+    def explain(endpoint: str | None, strict: bool):
+        from myblog.queryplan import capture, explain, get_workloads, is_slow
+
+        # The requests below must not start the ingest workers.
+        app.config["INGEST_START_WORKERS"] = False
+        workloads = get_workloads()
+        if endpoint:
+            workloads = {endpoint: workloads.get(endpoint, lambda client: None)}
+
+        slow = 0
+        for name, work in workloads.items():
+            click.echo(name)
+            for statement, parameters in capture(app, work):
+                click.echo(f"  {' '.join(statement.split())}")
+                for depth, detail in explain(statement, parameters):
+                    mark = "!" if is_slow(detail) else " "
+                    slow += mark == "!"
+                    click.echo(f"  {mark} {'  ' * depth}{detail}")
+
+        click.echo(f"{slow} slow steps.")
+        if strict and slow:
+            raise SystemExit(1)
 
     @app.cli.command("forge", help="Generate fake data.")
     @click.option("--category", default=5, help="Generate fake categories.")
@@ -33,19 +86,170 @@ def regisiter_command(app: Flask):
         from myblog.fakes import fake_categories, fake_comments, fake_posts
 
         db.drop_all()
-        db.create_all()
+        upgrade()
 
-        fake_categories(category)
+        with transaction():
+            fake_categories(category)
         click.echo(f"Generated {category} categories.")
 
-        fake_posts(post)
+        with transaction():
+            fake_posts(post)
         click.echo(f"Generated {post} posts.")
 
         fake_comments(comment)
         click.echo(f"Generated {comment} comments")
 
+        with transaction():
+            recount()
+
         click.echo("Done.")
 
+    @app.cli.command("bench-db", help="Compare read throughput under writes.")
+    @click.option("--readers", default=8, help="Reader threads.")
+    @click.option("--writers", default=2, help="Threads writing comments.")
+    @click.option("--duration", default=5.0, help="Seconds per profile.")
+    def bench_db(readers: int, writers: int, duration: float):
+        from myblog.benchmark import DEFAULT_PRAGMAS, run
+        from myblog.config import Prod
+
+        database = Path(db.engine.url.database)
+        profiles = dict(
+            default=(DEFAULT_PRAGMAS, {}),
+            production=(Prod.SQLITE_PRAGMAS, Prod.SQLALCHEMY_ENGINE_OPTIONS),
+        )
+        click.echo(
+            f"{readers} readers and {writers} writers for {duration}s on a copy "
+            f"of {database}."
+        )
+        for name, (pragmas, engine_options) in profiles.items():
+            result = run(database, pragmas, engine_options, readers, writers, duration)
+            click.echo(
+                f"{name}: {result['reads_per_second']:.0f} reads/s "
+                f"(p50 {result['p50']:.2f}ms, p99 {result['p99']:.2f}ms, "
+                f"max {result['max']:.2f}ms), "
+                f"{result['writes_per_second']:.0f} writes/s, "
+                f"{result['errors']} errors."
+            )
+
+    @app.cli.command("render-cache", help="Show or clear the post render cache.")
+    @click.option("--clear", is_flag=True, help="Drop every cached render.")
+    def render_cache(clear: bool):
+        cache = get_render_cache()
+        if not cache:
+            click.echo("Render cache is disabled.")
+            return None
+
+        if clear:
+            cache.clear()
+            click.echo("Cleared render cache.")
+
+        stats = cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / lookups if lookups else 0
+        click.echo(f"Entries: {stats['entries']}")
+        click.echo(f"Size: {stats['size']}/{stats['max_size']} bytes")
+        click.echo(f"Hits: {stats['hits']}, misses: {stats['misses']} ({ratio:.1%})")
+        click.echo(f"Evictions: {stats['evictions']}")
+
+    @app.cli.command("page-cache", help="Show or clear the visitor page cache.")
+    @click.option("--clear", is_flag=True, help="Drop every cached page.")
+    def page_cache(clear: bool):
+        cache = get_page_cache()
+        if not cache:
+            click.echo("Page cache is disabled.")
+            return None
+
+        if clear:
+            cache.clear()
+            click.echo("Cleared page cache.")
+
+        stats = cache.stats()
+        click.echo(f"Entries: {stats['entries']}/{stats['max_entries']}")
+
+    @app.cli.command("reindex", help="Rebuild posts from the whole worktree.")
+    @click.option("--workers", default=None, type=int, help="Worker processes.")
+    @click.option("--chunk-size", default=100, help="Posts written per commit.")
+    def reindex(workers: int | None, chunk_size: int):
+        from myblog.ingest import reindex, walk_posts
+
+        start = time.perf_counter()
+        paths = walk_posts()
+        saved, errors = reindex(paths, workers=workers, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+
+        for path, messages in errors.items():
+            for message in messages:
+                click.echo(f"{path}: {message}", err=True)
+
+        rate = len(paths) / elapsed if elapsed else 0
+        click.echo(
+            f"Indexed {saved}/{len(paths)} posts in {elapsed:.2f}s "
+            f"({rate:.1f} files/s), {len(errors)} failed."
+        )
+
+    @app.cli.command("drain-spool", help="Replay changes the git hook spooled.")
+    @click.option("--apply/--no-apply", default=True, help="Apply queued jobs now.")
+    def drain_spool(apply: bool):
+        from myblog.jobqueue import drain_spool, run_once
+
+        drained = drain_spool(
+            app.config["PATH_SPOOL"],
+            app.config["SPOOL_RETRY_ATTEMPTS"],
+            app.config["SPOOL_RETRY_DELAY"],
+        )
+        click.echo(f"Queued {drained} spooled pushes.")
+
+        if apply:
+            applied = 0
+            while count := run_once(app.config["INGEST_BATCH_SIZE"]):
+                applied += count
+            click.echo(f"Applied {applied} changed files.")
+
+    @app.cli.command("work", help="Run the ingest workers until interrupted.")
+    @click.option("--workers", type=int, default=None, help="Number of threads.")
+    def work(workers: int | None):
+        worker = app.extensions["ingest_worker"]
+        worker.workers = workers or worker.workers or 1
+        worker.start(app)
+
+        try:
+            while any(thread.is_alive() for thread in worker.threads):
+                for thread in worker.threads:
+                    thread.join(1)
+        except KeyboardInterrupt:
+            pass
+
+    @app.cli.command("sync", help="Reconcile the database with the worktree.")
+    @click.option("--prune", is_flag=True, help="Delete posts without a file.")
+    def sync(prune: bool):
+        from myblog.manifest import sync
+
+        start = time.perf_counter()
+        report = sync(prune=prune)
+        elapsed = time.perf_counter() - start
+
+        for result in report["results"]:
+            if result["status"] == "failed":
+                click.echo(f"{result['path']}: {result['messages']}", err=True)
+        for path in report["missing"]:
+            click.echo(f"Kept the post of missing file {path}, see --prune.")
+        for title in report["orphans"]:
+            action = "Deleted" if prune else "Found"
+            click.echo(f"{action} orphaned post {title}.")
+
+        click.echo(
+            f"Scanned {report['scanned']} files in {elapsed:.3f}s: "
+            f"{report['changed']} changed, {report['renamed']} renamed, "
+            f"{report['removed']} removed, {len(report['orphans'])} orphaned posts."
+        )
+
+    @app.cli.command("watch", help="Ingest posts as they change in the worktree.")
+    @click.option("--debounce", default=None, type=float, help="Quiet seconds.")
+    def watch(debounce: float | None):
+        from myblog.watcher import watch
+
+        watch(app, debounce or app.config["WATCH_DEBOUNCE"], report=click.echo)
+
     @app.cli.command("initowner", help="Init user's gitdir and worktree.")
     def initowner():
         owner = OwnerProfile()
@@ -22,6 +22,8 @@ else:
 class Base:
     PATH_ROOT: Path = Path(__file__).parent.parent
     PATH_LOG: Path = PATH_ROOT.joinpath("log")
+    # Files the app writes at run time, kept out of the source tree.
+    PATH_INSTANCE: Path = PATH_ROOT.joinpath("instance")
     PATH_STATIC: Path = Path(__file__).parent.joinpath("view", "static")
     PATH_TEMPLATES: Path = Path(__file__).parent.joinpath("view", "templates")
 
@@ -31,6 +33,37 @@ class Base:
     SECRET_KEY: bytes = os.getenv("SECRET_KEY").encode("UTF-8")
 
     COMMENT_PER_PAGE: int = 10
+    POST_PER_PAGE: int = 20
+
+    # Run on every new database connection.
+    SQLITE_PRAGMAS: dict[str, str | int] = dict(busy_timeout=5000)
+
+    PROFILE_CHECK_INTERVAL: float = 2.0
+
+    RENDER_CACHE_ENABLED: bool = True
+    PATH_RENDER_CACHE: Path = PATH_INSTANCE.joinpath("render-cache.db")
+    RENDER_CACHE_MAX_SIZE: int = 64 * 1024 * 1024
+
+    # Without a path, pages are cached by each process on its own, and writes
+    # made by other processes, such as flask reindex, do not reach them.
+    PAGE_CACHE_ENABLED: bool = True
+    PATH_PAGE_CACHE: Path | None = PATH_INSTANCE.joinpath("page-cache.db")
+    PAGE_CACHE_MAX_ENTRIES: int = 1024
+
+    INGEST_WORKERS: int = 2
+    # Workers start with the first request a process serves, never in flask
+    # commands. Set it to 0 when the workers run apart with 'flask work'.
+    INGEST_START_WORKERS: bool = os.getenv("INGEST_START_WORKERS", "1") != "0"
+    INGEST_BATCH_SIZE: int = 200
+    INGEST_POLL_INTERVAL: float = 5.0
+    # Running tasks claimed longer ago are taken back, as their worker died.
+    INGEST_LEASE_TIMEOUT: float = 600.0
+
+    PATH_SPOOL: Path = PATH_GITDIR.joinpath("spool")
+    SPOOL_RETRY_ATTEMPTS: int = 5
+    SPOOL_RETRY_DELAY: float = 0.5
+
+    WATCH_DEBOUNCE: float = 0.5
 
     MAIL_SERVER = os.getenv("MAIL_SERVER")
     MAIL_PORT = int(os.getenv("MAIL_PORT"))
@@ -45,11 +78,33 @@ class Dev(Base):
 
 
 class Prod(Base):
-    ...
+    SQLALCHEMY_DATABASE_URI: str = os.getenv(
+        "DATABASE_URL", prefix + str(Base.PATH_ROOT.joinpath("data.db"))
+    )
+    SQLALCHEMY_ENGINE_OPTIONS: dict = dict(
+        pool_size=10, max_overflow=10, pool_timeout=10, pool_recycle=3600
+    )
+
+    # Readers never wait for the writer with WAL, and NORMAL only syncs at
+    # checkpoints, which is still safe against corruption in WAL mode.
+    SQLITE_PRAGMAS: dict[str, str | int] = dict(
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        busy_timeout=5000,
+        cache_size=-64 * 1024,
+        mmap_size=256 * 1024 * 1024,
+        temp_store="MEMORY",
+        journal_size_limit=64 * 1024 * 1024,
+    )
 
 
 class Test(Base):
-    ...
+    TESTING: bool = True
+    SQLALCHEMY_DATABASE_URI: str = "sqlite://"
+    RENDER_CACHE_ENABLED: bool = False
+    PAGE_CACHE_ENABLED: bool = False
+    INGEST_WORKERS: int = 0
+    INGEST_START_WORKERS: bool = False
 
 
 def get_config(environment=None):
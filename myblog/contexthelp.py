@@ -4,16 +4,12 @@ Created: 2023-12-03
 Author: Gao Tianchi
 """
 
-
-import datetime
-
-from dateutil.relativedelta import relativedelta
 from flask import Flask
 
 from .flaskexten import db
 from .model.database import Category, Comment, Post
 from .model.fileitem import OwnerProfile, PostFile
-from .utlis import archive_post_by_date, title_to_url
+from .utlis import title_to_url
 
 
 def register_context_processor(app: Flask):
@@ -30,13 +26,5 @@ def register_context_processor(app: Flask):
 
     @app.context_processor
     def make_template_context():
-        return dict(
-            archive_post_by_date=archive_post_by_date,
-            datetime=datetime,
-            relativedelta=relativedelta,
-            sorted=sorted,
-            ttu=title_to_url,
-            owner=OwnerProfile(),
-            postdb=Post,
-            categorydb=Category,
-        )
+        # Pages get their data from the views, already computed.
+        return dict(ttu=title_to_url, owner=OwnerProfile())
@@ -7,4 +7,6 @@ from .account import account as bp_account
 from .auth import auth as bp_auth
 from .author import author as bp_author
 from .owner import owner as bp_owner
-from .visitor2 import visitor as bp_visitor
+from .visitor import visitor as bp_visitor
+from .visitor2 import legacy as bp_legacy_api
+from .visitor2 import visitor as bp_api
@@ -4,13 +4,12 @@ Created at: 2023-12-06
 Author: Gao Tianchi
 """
 
-
 import json
 
 from flask import Blueprint, abort, jsonify, request, session, url_for
 
 from myblog.email import send_email
-from myblog.model.database import Blog, User
+from myblog.model.database import Blog, User, transaction
 
 from .auth import decrypt_data, encrypt_data
 
@@ -21,7 +20,8 @@ account = Blueprint("account", __name__)
 def delete_account(id: int):
     user = User.query.get(id)
     # Verify and confirm.
-    user.delete()
+    with transaction():
+        user.delete()
     return jsonify("Deleted account."), 200
 
 
@@ -43,7 +43,8 @@ def update_email(id: int):
         # Validate token.
         decrypted_data = json.loads(decrypt_data(token))
         new_email = decrypted_data["new_email"]
-        user.update_email(new_email)
+        with transaction():
+            user.update_email(new_email)
         return jsonify("Changed email."), 200
 
     return abort(400)
@@ -60,13 +61,14 @@ def update_blog_information(id: int):
         link = form.get("link")
         description = form.get("description")
 
-        new_blog = blog.update(
-            title=title,
-            subtitle=subtitle,
-            language=language,
-            link=link,
-            description=description,
-        )
+        with transaction():
+            new_blog = blog.update(
+                title=title,
+                subtitle=subtitle,
+                language=language,
+                link=link,
+                description=description,
+            )
 
         return jsonify(f"Update blog {new_blog.title}"), 200
 
@@ -83,9 +85,10 @@ def update_user_information(id):
         new_timezone = form.get("timezone")
         new_intro = form.get("intro")
         new_detail = form.get("detail")
-        user.update_information(
-            new_name, new_username, new_timezone, new_intro, new_detail
-        )
+        with transaction():
+            user.update_information(
+                new_name, new_username, new_timezone, new_intro, new_detail
+            )
 
         return jsonify(user.name), 200
 
@@ -97,7 +100,8 @@ def update_password(id: int):
     user = User.query.get(id)
     if request.form:
         new_password = request.form.get("new_password")
-        user.update_password(new_password)
+        with transaction():
+            user.update_password(new_password)
         return jsonify("Changed password."), 200
 
     return abort(400)
@@ -151,7 +155,8 @@ def sign_up():
         email = decrypted_data["email"]
         password = decrypted_data["password"]
 
-        new_user = User.create(name, email, password)
+        with transaction():
+            new_user = User.create(name, email, password)
 
         return jsonify(f"Successfully create new user {new_user.name}"), 201
 
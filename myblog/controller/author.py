@@ -3,10 +3,9 @@ Created at: 2023-12-06
 Author: Gao Tianchi
 """
 
-
 from flask import Blueprint, g, jsonify, request
 
-from myblog.model.database import Category, Post
+from myblog.model.database import Category, Post, transaction
 
 author = Blueprint("author", __name__)
 
@@ -18,12 +17,13 @@ def add_category():
     slug = form.get("slug")
     meta_title = form.get("meta_title")
     content = form.get("content")
-    new_category = Category.create(
-        title=title,
-        slug=slug,
-        meta_title=meta_title,
-        content=content,
-    )
+    with transaction():
+        new_category = Category.create(
+            title=title,
+            slug=slug,
+            meta_title=meta_title,
+            content=content,
+        )
     return jsonify(f"Created category {new_category.title}"), 201
 
 
@@ -36,12 +36,13 @@ def update_category(id: int):
     content = form.get("content")
 
     category = Category.query.get(id)
-    category.update(
-        title=title,
-        slug=slug,
-        meta_title=meta_title,
-        content=content,
-    )
+    with transaction():
+        category.update(
+            title=title,
+            slug=slug,
+            meta_title=meta_title,
+            content=content,
+        )
 
     return jsonify(f"Updated category {category.title}."), 200
 
@@ -60,17 +61,18 @@ def update_post(id: int):
     toc = form.get("toc")
 
     post = Post.query.get(id)
-    post.update(
-        title=title,
-        content=content,
-        published=published,
-        slug=slug,
-        meta_title=meta_title,
-        author=author,
-        category=category,
-        summary=summary,
-        toc=toc,
-    )
+    with transaction():
+        post.update(
+            title=title,
+            content=content,
+            published=published,
+            slug=slug,
+            meta_title=meta_title,
+            author=author,
+            category=category,
+            summary=summary,
+            toc=toc,
+        )
 
     return jsonify(f"Updated post {post.title}"), 200
 
@@ -88,17 +90,18 @@ def add_post():
     summary = form.get("summary")
     toc = form.get("toc")
 
-    new_post = Post.create(
-        title=title,
-        content=content,
-        published=published,
-        slug=slug,
-        meta_title=meta_title,
-        author=author,
-        category=category,
-        summary=summary,
-        toc=toc,
-    )
+    with transaction():
+        new_post = Post.create(
+            title=title,
+            content=content,
+            published=published,
+            slug=slug,
+            meta_title=meta_title,
+            author=author,
+            category=category,
+            summary=summary,
+            toc=toc,
+        )
 
     return jsonify(f"Created post {new_post.title}"), 201
 
@@ -107,7 +110,8 @@ def add_post():
 def delete_post(id: int):
     post = Post.query.get(id)
     title = post.title
-    post.delete()
+    with transaction():
+        post.delete()
     return jsonify(f"Deleted post {title}."), 200
 
 
@@ -115,5 +119,6 @@ def delete_post(id: int):
 def delete_category(id: int):
     category = Category.query.get(id)
     title = category.title
-    category.delete()
+    with transaction():
+        category.delete()
     return jsonify(f"Deleted category {title}."), 200
@@ -5,14 +5,13 @@ Author: Gao Tianchi
 
 import logging
 import re
-from pathlib import Path
+import subprocess
 
 from flask import (
     Blueprint,
     abort,
     current_app,
     jsonify,
-    make_response,
     redirect,
     render_template,
     request,
@@ -20,9 +19,10 @@ from flask import (
     url_for,
 )
 
-from myblog.model.database import Category, Comment, Post
-from myblog.model.fileitem import OwnerProfile, PostFile
-from myblog.model.render import get_render
+from myblog.ingest import read_payload
+from myblog.jobqueue import enqueue
+from myblog.model.database import Comment, Job, transaction
+from myblog.model.pagination import paginate
 from myblog.model.validator import get_validator
 
 owner = Blueprint("owner", __name__)
@@ -66,103 +66,56 @@ def validate_owner() -> None:
     logger.info("Successfully log in.")
 
 
-@owner.route("/add/post", methods=["POST"])
-def add_post():
+def enqueue_change(mode: str) -> tuple:
     json_items: dict = request.json
     _filepath: list[str] = json_items.get("path")
     if not _filepath:
         logger.error(f"File path was not found in the json filed.")
         abort(400)
-    filepath: Path = OwnerProfile.WORKTREE.joinpath(*_filepath[0].split("/"))
-    post = PostFile(filepath)
 
-    if not post.is_post():
-        logger.warning(f"File {filepath} is not a post.")
-        return abort(400)
+    job = enqueue([dict(mode=mode, path=_filepath)])
 
-    render = get_render("post")
-    post = render(post)
+    return jsonify(job.to_dict()), 202
 
-    validator = get_validator("post")
-    validator.set(post)
-
-    if not validator.validate():
-        message = validator.get_message()
-        return abort(make_response(message, 400))
 
-    category = Category.create(post.category)
-    new_post = Post.create(
-        post.title, post.html, category.id, post.author, post.toc, post.summary
-    )
-
-    return jsonify(new_post.to_json())
+@owner.route("/add/post", methods=["POST"])
+def add_post():
+    return enqueue_change("A")
 
 
 @owner.route("/modify/post", methods=["PATCH"])
 def modify_post():
-    json_items: dict = request.json
-    _filepath: list[str] = json_items.get("path")
-    if not _filepath:
-        logger.error(f"File path was not found in the json filed.")
-        abort(400)
-
-    filepath: Path = OwnerProfile.WORKTREE.joinpath(*_filepath[0].split("/"))
-    post = PostFile(filepath)
-    old_title_file = post
-
-    if len(_filepath) == 2:
-        new_title_file = OwnerProfile.WORKTREE.joinpath(*_filepath[1].split("/"))
-        post = PostFile(new_title_file)
-
-    if not post.is_post():
-        logger.warning(f"File {filepath} is not a post.")
-        return abort(400)
+    mode = "R" if len(request.json.get("path") or []) == 2 else "M"
+    return enqueue_change(mode)
 
-    render = get_render("post")
-    post = render(post)
 
-    validator = get_validator("post")
-    validator.set(post)
-
-    if not validator.validate():
-        message = validator.get_message()
-        return abort(make_response(message, 400))
-
-    category = Category.create(post.category)
-    old_post = Post.query.filter_by(title=old_title_file.title).first_or_404()
+@owner.route("/delete/post", methods=["DELETE"])
+def delete_post():
+    return enqueue_change("D")
 
-    old_categroy = old_post.category
-    posts_with_same_category: list = old_categroy.posts
-    if (old_title_file.title != post.category) and len(posts_with_same_category) == 1:
-        logger.info(f"Deleted empty category {old_categroy}.")
-        old_categroy.delete()
 
-    new_post = old_post.modify(
-        post.title, post.html, category.id, post.author, post.toc, post.summary
-    )
+@owner.route("/batch/post", methods=["POST"])
+def batch_post():
+    payload: list | dict | None = request.json
+    if not isinstance(payload, (list, dict)):
+        logger.error("Changed files or revisions were expected in the json field.")
+        return abort(400)
 
-    return jsonify(new_post.to_json())
+    try:
+        changes = read_payload(payload)
+    except (subprocess.CalledProcessError, ValueError) as e:
+        logger.error(f"Fail to read the revisions {payload} with error {e}.")
+        return abort(400)
 
+    job = enqueue(changes, key=request.headers.get("Idempotency-Key"))
 
-@owner.route("/delete/post", methods=["DELETE"])
-def delete_post():
-    json_items: dict = request.json
-    _filepath: list[str] = json_items.get("path")
-    if not _filepath:
-        logger.error(f"File path was not found in the json filed.")
-        abort(400)
-    filepath: Path = OwnerProfile.WORKTREE.joinpath(*_filepath[0].split("/"))
-    post = PostFile(filepath)
+    return jsonify(job.to_dict()), 202
 
-    old_post = Post.query.filter_by(title=post.title).first_or_404()
-    old_categroy = old_post.category
-    posts_with_same_category: list = old_categroy.posts
-    if len(posts_with_same_category) == 1:
-        logger.info(f"Deleted empty category {old_categroy}.")
-        old_categroy.delete()
-    old_post.delete()
 
-    return jsonify(f"Successfully delete '{post.title}'.")
+@owner.route("/job/<int:job_id>", methods=["GET"])
+def read_job(job_id: int):
+    job = Job.query.get_or_404(job_id)
+    return jsonify(job.to_dict()), 200
 
 
 @owner.route("/login", methods=["GET", "POST"])
@@ -193,20 +146,24 @@ def manage():
 
 @owner.route("/manage/comment", methods=["GET", "POST"])
 def manage_comment():
-    page = request.args.get("page", type=int, default=1)
     per_page = current_app.config["COMMENT_PER_PAGE"]
-    comments = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page=page, per_page=per_page
-    )
-    total_page = Comment.query.count() // per_page + 1
-    return render_template(
-        "manage-comment.html", comments=comments, page=page, total_page=total_page
-    )
+    try:
+        comments = paginate(
+            Comment.query,
+            (Comment.timestamp, Comment.id),
+            per_page,
+            cursor=request.args.get("cursor"),
+        )
+    except ValueError:
+        abort(400)
+
+    return render_template("manage-comment.html", comments=comments)
 
 
 @owner.route("/delete/comment/<comment_id>", methods=["POST"])
 def delete_comment(comment_id: int):
     comment = Comment.query.get_or_404(comment_id)
-    comment.delete()
+    with transaction():
+        comment.delete()
 
     return redirect(url_for("owner.manage_comment"))
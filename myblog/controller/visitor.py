@@ -7,19 +7,33 @@ import logging
 import re
 from datetime import datetime, timedelta
 
+from dateutil.relativedelta import relativedelta
 from flask import (
     Blueprint,
     abort,
+    current_app,
     make_response,
     redirect,
     render_template,
     request,
     url_for,
 )
-from sqlalchemy import and_
-
-from myblog.model.database import Category, Comment, Post
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, load_only, undefer_group
+
+from myblog.flaskexten import db
+from myblog.freshness import get_validators
+from myblog.model.database import (
+    Blog,
+    Category,
+    Comment,
+    Post,
+    search_posts,
+    transaction,
+)
+from myblog.model.pagination import paginate
 from myblog.model.render import get_render
+from myblog.pagecache import cache_page, get_fragment
 from myblog.utlis import title_to_url
 
 visitor = Blueprint("visitor", __name__)
@@ -28,17 +42,30 @@ logger = logging.getLogger("controller.visitor")
 
 
 @visitor.route("/read/post/<post_id>/<post_title>", methods=["GET", "POST"])
+@cache_page(lambda post_id, post_title: [f"post:{post_id}"])
 def read_post(post_id: int, post_title: str):
-    post = Post.query.get_or_404(post_id)
-    if not title_to_url(post.title) == post_title:
+    # Answer with 304 before the post and its comments are loaded.
+    row = db.session.execute(
+        select(Post.title, Post.version, Post.changed_at).where(Post.id == post_id)
+    ).first()
+    if not row or not title_to_url(row.title) == post_title:
         abort(404)
+    validators = get_validators(f"post:{post_id}", row.version, row.changed_at)
+    not_modified = validators.not_modified()
+    if not_modified:
+        return not_modified
+
+    post = db.get_or_404(
+        Post, post_id, options=[joinedload(Post.category), undefer_group("body")]
+    )
 
     if request.form:
         comment_content = request.form.get("comment-area")
         render = get_render("comment")
         comment_content = render(comment_content)
         reply_to_id = request.args.get("reply_to", type=int)
-        new_comment = Comment.create(comment_content, post.id, reply_to_id)
+        with transaction():
+            new_comment = Comment.create(comment_content, post.id, reply_to_id)
         return redirect(
             url_for(
                 "visitor.read_post",
@@ -48,15 +75,25 @@ def read_post(post_id: int, post_title: str):
             + f"#comment-{new_comment.id}"
         )
 
-    comments = Comment.query.with_parent(post).order_by(Comment.timestamp.desc()).all()
+    comments = Comment.load_thread(post.id)
 
-    return render_template("post-detail.html", post=post, comments=comments)
+    content = render_template("post-detail.html", post=post, comments=comments)
+    return validators.apply(make_response(content))
 
 
 @visitor.route("/")
 @visitor.route("/archive/post", methods=["GET"])
+@cache_page(lambda: ["blog"])
 def archive_post():
-    posts_query = Post.query
+    blog = Blog.query.first()
+    validators = get_validators(
+        "archive", blog.version if blog else 0, blog.changed_at if blog else None
+    )
+    not_modified = validators.not_modified()
+    if not_modified:
+        return not_modified
+
+    posts_query = Post.query.filter_by(published=True)
 
     category_name: str = request.args.get("category")
     sort_by: str = request.args.get("sort_by", "newest")
@@ -65,19 +102,11 @@ def archive_post():
     to_date: str = request.args.get("to")
     t = timedelta()
 
-    match sort_by:
-        case "oldest":
-            sort_method = Post.modified.asc()
-        case _:
-            sort_method = Post.modified.desc()
-
-    posts_query = posts_query.order_by(sort_method)
-
     if category_name:
         category_name = re.sub("-", " ", category_name)
         category = Category.query.filter_by(title=category_name).first()
         if category:
-            posts_query = posts_query.with_parent(category)
+            posts_query = posts_query.filter(Post.category_id == category.id)
         else:
             return abort(400)
 
@@ -86,7 +115,7 @@ def archive_post():
         m_1 = re.match(date_pattern, from_date)
         if m_1:
             f_date = datetime.fromisoformat(m_1.group(0))
-            posts_query = posts_query.filter(Post.created >= f_date)
+            posts_query = posts_query.filter(Post.published_at >= f_date)
         else:
             abort(400)
 
@@ -94,21 +123,110 @@ def archive_post():
         m_2 = re.match(date_pattern, to_date)
         if m_2:
             t_date = datetime.fromisoformat(m_2.group(0))
-            posts_query = posts_query.filter(Post.created < t_date)
+            posts_query = posts_query.filter(Post.published_at < t_date)
         else:
             abort(400)
 
-    posts = posts_query.all()
+    try:
+        posts = paginate(
+            posts_query.options(load_only(Post.id, Post.title, Post.published_at)),
+            (Post.published_at, Post.id),
+            current_app.config["POST_PER_PAGE"],
+            cursor=request.args.get("cursor"),
+            descending=sort_by != "oldest",
+        )
+    except ValueError:
+        abort(400)
+
+    # Pages keep the filters of the listing they belong to.
+    filters = request.args.to_dict()
+    filters.pop("cursor", None)
+
+    content = render_template(
+        "archive-post.html",
+        posts=posts,
+        filters=filters,
+        categories=get_fragment("categories", ["blog"], make_categories),
+        post_count=blog.published_count if blog else 0,
+        date_tree=get_fragment("date-tree", ["blog"], make_date_tree),
+    )
+    return validators.apply(make_response(content))
+
+
+def make_categories() -> list[dict]:
+    categories = Category.query.order_by(Category.id).all()
+    return [
+        dict(title=category.title, post_count=category.post_count)
+        for category in categories
+    ]
+
+
+def make_date_tree() -> list[dict]:
+    # Years, and the months of each with how many posts they have and the
+    # bounds of the archive filter which lists them.
+
+    tree: list[dict] = []
+    for year, month, count in Post.count_by_month():
+        if not tree or tree[-1]["year"] != year:
+            tree.append(dict(year=year, months=[]))
+
+        start = datetime(year, month, 1)
+        end = start + relativedelta(months=1)
+        tree[-1]["months"].append(
+            dict(
+                month=month,
+                count=count,
+                start=start.strftime("%Y-%m-%d"),
+                end=end.strftime("%Y-%m-%d"),
+            )
+        )
+
+    return tree
+
 
-    return render_template("archive-post.html", posts=posts)
+@visitor.route("/search", methods=["GET"])
+@cache_page(lambda: ["blog"])
+def search_post():
+    terms: str = request.args.get("q", "").strip()
+    page: int = request.args.get("page", 1, type=int)
+    if page < 1:
+        abort(400)
+
+    results, more = search_posts(terms, page, current_app.config["POST_PER_PAGE"])
+
+    return render_template(
+        "search-post.html",
+        terms=terms,
+        results=results,
+        next_page=page + 1 if more else None,
+        prev_page=page - 1 if page > 1 else None,
+    )
 
 
 @visitor.route("/rss", methods=["GET"])
+@cache_page(lambda: ["blog"])
 def rss():
-    posts = Post.query.order_by(Post.created.desc()).all()
+    blog = Blog.query.first()
+    validators = get_validators(
+        "rss", blog.version if blog else 0, blog.changed_at if blog else None
+    )
+    not_modified = validators.not_modified()
+    if not_modified:
+        return not_modified
+
+    posts = (
+        Post.query.filter_by(published=True)
+        .options(
+            load_only(Post.id, Post.title, Post.summary, Post.published_at),
+            joinedload(Post.category).load_only(Category.title),
+            joinedload(Post.author),
+        )
+        .order_by(Post.published_at.desc())
+        .all()
+    )
 
     content = render_template("rss.xml", posts=posts)
     response = make_response(content)
     response.headers["Content-Type"] = "application/rss+xml"
 
-    return response
+    return validators.apply(response)
@@ -2,24 +2,116 @@
 Created at: 2023-12-06
 Author: Gao Tianchi
 """
-import json
+
 from pathlib import Path
 
-from flask import Blueprint, current_app, jsonify
+from flask import Blueprint, current_app, jsonify, redirect, request, url_for
+from sqlalchemy import select
+from sqlalchemy.orm import load_only
 
-from myblog.model.database import Post
-from myblog.utlis import DateTimeEncoder
+from myblog.flaskexten import db
+from myblog.freshness import get_validators
+from myblog.model.database import Comment, Post
+from myblog.model.pagination import Page, paginate
 
 visitor = Blueprint("visitor", __name__)
 
+# The JSON API used to be served from the root, its old URLs still lead there.
+legacy = Blueprint("legacy_api", __name__)
+
+
+@legacy.route("/read/post/<slug>", methods=["GET"])
+def old_read_post(slug: str):
+    return redirect(url_for("api.read_post", slug=slug), 308)
+
+
+@legacy.route("/example", methods=["GET"])
+def old_example():
+    return redirect(url_for("api.example"), 308)
+
 
 @visitor.route("/read/post/<slug>", methods=["GET"])
 def read_post(slug: str):
-    post = Post.query.filter_by(slug=slug).first()
+    # The JSON was made when the post was written.
+    row = db.session.execute(
+        select(Post.id, Post.version, Post.changed_at, Post.document)
+        .where(Post.slug == slug)
+        .limit(1)
+    ).first()
+    if not row or not row.document:
+        return jsonify("No post was found."), 404
+
+    validators = get_validators(
+        f"api:post:{row.id}", row.version, row.changed_at, page=False
+    )
+    not_modified = validators.not_modified()
+    if not_modified:
+        return not_modified
+
+    response = current_app.response_class(row.document, mimetype="application/json")
+    return validators.apply(response), 200
+
+
+def page_to_dict(page: Page, items: list[dict]) -> dict:
+    return dict(items=items, next=page.next, prev=page.prev)
+
+
+@visitor.route("/posts", methods=["GET"])
+def list_posts():
+    query = Post.query.filter_by(published=True).options(
+        load_only(Post.id, Post.title, Post.slug, Post.summary, Post.published_at)
+    )
+    try:
+        posts = paginate(
+            query,
+            (Post.published_at, Post.id),
+            current_app.config["POST_PER_PAGE"],
+            cursor=request.args.get("cursor"),
+        )
+    except ValueError:
+        return jsonify("Invalid cursor."), 400
+
+    items = [
+        dict(
+            id=post.id,
+            title=post.title,
+            slug=post.slug,
+            summary=post.summary,
+            published_at=post.published_at,
+        )
+        for post in posts
+    ]
+    return jsonify(page_to_dict(posts, items)), 200
+
+
+@visitor.route("/read/post/<slug>/comments", methods=["GET"])
+def list_comments(slug: str):
+    post = Post.query.filter_by(slug=slug).options(load_only(Post.id)).first()
     if not post:
         return jsonify("No post was found."), 404
-    data = json.dumps(post.to_dict(), cls=DateTimeEncoder, indent=4)
-    return jsonify(data), 200
+
+    try:
+        comments = paginate(
+            Comment.query.filter_by(post_id=post.id),
+            (Comment.timestamp, Comment.id),
+            current_app.config["COMMENT_PER_PAGE"],
+            cursor=request.args.get("cursor"),
+            descending=False,
+        )
+    except ValueError:
+        return jsonify("Invalid cursor."), 400
+
+    items = [
+        dict(
+            id=comment.id,
+            content=comment.content,
+            from_owner=comment.from_owner,
+            timestamp=comment.timestamp,
+            reply_to_id=comment.reply_to_id,
+        )
+        for comment in comments
+    ]
+    return jsonify(page_to_dict(comments, items)), 200
 
 
 @visitor.route("/example", methods=["GET"])
@@ -3,13 +3,12 @@ Created: 2023-11-25
 Author: Gao Tianchi
 """
 
-
 import random
 
 from faker import Faker
 
 from .flaskexten import db
-from .model.database import Category, Comment, Post, User
+from .model.database import Category, Comment, Post, User, transaction
 
 fake = Faker()
 
@@ -62,24 +61,14 @@ def fake_posts(count: int = 10):
 
 
 def fake_comments(count: int = 100):
-    for _ in range(count):
-        comment = Comment(
-            content=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            post=Post.query.get(random.randint(1, Post.query.count())),
-        )
-        db.session.add(comment)
-
-    db.session.commit()
-
-    for _ in range(count):
-        reply_to = Comment.query.get(random.randint(1, Comment.query.count()))
-        post = reply_to.post
-        comment = Comment(
-            content=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            reply_to=reply_to,
-            post=post,
-        )
-        db.session.add(comment)
-    db.session.commit()
+    with transaction():
+        for _ in range(count):
+            post = Post.query.get(random.randint(1, Post.query.count()))
+            comment = Comment.create(fake.sentence(), post.id)
+            comment.timestamp = fake.date_time_this_year()
+
+    with transaction():
+        for _ in range(count):
+            reply_to = Comment.query.get(random.randint(1, Comment.query.count()))
+            comment = Comment.create(fake.sentence(), reply_to.post_id, reply_to.id)
+            comment.timestamp = fake.date_time_this_year()
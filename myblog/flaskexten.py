@@ -7,6 +7,7 @@ from flask_cors import CORS
 from flask_mail import Mail
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+# Objects stay usable after a commit without being selected again.
+db = SQLAlchemy(session_options=dict(expire_on_commit=False))
 mail = Mail()
 cors = CORS()
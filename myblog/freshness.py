@@ -0,0 +1,62 @@
+"""
+Summary: Validators of visitor pages, so unchanged pages are answered with 304.
+Created: 2023-12-22
+Author: Gao Tianchi
+"""
+
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+from flask import Response, current_app, request
+from werkzeug.http import is_resource_modified
+
+from .model.fileitem import OwnerProfile
+
+logger = logging.getLogger("root.freshness")
+
+
+class Validators:
+    """The strong ETag and the Last-Modified time of a response."""
+
+    def __init__(self, etag: str, last_modified: datetime) -> None:
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def not_modified(self) -> Response | None:
+        # A 304 response when the client has this version, otherwise None.
+
+        if is_resource_modified(
+            request.environ, etag=self.etag, last_modified=self.last_modified
+        ):
+            return None
+
+        logger.debug(f"Not modified: {request.path}")
+        return self.apply(current_app.response_class(status=304))
+
+    def apply(self, response: Response) -> Response:
+        response.set_etag(self.etag)
+        response.last_modified = self.last_modified
+        return response
+
+
+def get_validators(
+    name: str, version: int, changed_at: datetime | None, page: bool = True
+) -> Validators:
+    """Get the validators of a response made from rows at this version.
+
+    Pages show the owner profile too, so a change of profile.json changes
+    their validators as well. Times are stored in UTC without a timezone.
+    """
+
+    parts = [name, version]
+    last_modified = (changed_at or datetime.min).replace(tzinfo=timezone.utc)
+    signature = OwnerProfile.get_signature() if page else None
+    if signature:
+        parts.extend(signature)
+        modified = datetime.fromtimestamp(signature[0] / 1e9, timezone.utc)
+        last_modified = max(last_modified, modified)
+
+    etag = hashlib.sha1(":".join(map(str, parts)).encode("utf-8")).hexdigest()
+    # HTTP dates have no fractions of a second.
+    return Validators(etag, last_modified.replace(microsecond=0))
@@ -0,0 +1,377 @@
+"""
+Summary: Turn post files of the worktree into database rows.
+Created: 2023-12-10
+Author: Gao Tianchi
+"""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import select
+
+from .flaskexten import db
+from .model.database import Category, Post, User, transaction
+from .model.fileitem import OwnerProfile, PostFile
+from .model.gitobject import CatFile, diff_name_status
+from .model.render import get_render, get_render_cache, use_render_cache
+from .model.validator import get_validator
+from .utlis import get_local_datetime, title_to_url
+
+logger = logging.getLogger("root.ingest")
+
+PROFILE_PATH: str = "profile.json"
+
+
+def load_post(
+    path: Path, text: str | None = None, render: bool = True
+) -> tuple[PostFile | None, list[str]]:
+    # Parse, validate and render one post file. Safe to run in a worker process.
+    # Files which are not posts give neither a post nor an error message.
+
+    try:
+        post = PostFile(path, text=text)
+
+        if not post.is_post():
+            return None, []
+
+        validator = get_validator("post")
+        validator.set(post)
+        if not validator.validate():
+            return None, validator.get_message()
+
+        if render:
+            post = get_render("post")(post)
+    except Exception as e:
+        logger.exception(f"Fail to load post {path}.")
+        return None, [f"Fail to load post {path} with error {e}."]
+
+    return post, []
+
+
+def get_author(name: str) -> User | None:
+    author = User.query.filter_by(name=name).first()
+    if author:
+        return author
+
+    return User.query.first()
+
+
+def get_category(title: str) -> Category:
+    category = Category.query.filter_by(title=title).first()
+    if category:
+        return category
+
+    return Category.create(
+        title=title,
+        slug=title_to_url(title).lower(),
+        meta_title=title,
+    )
+
+
+def is_unchanged(
+    post: PostFile, body_hash: str | None, metadata_hash: str | None
+) -> bool:
+    return post.body_hash == body_hash and post.metadata_hash == metadata_hash
+
+
+def get_hashes(title: str) -> tuple[int | None, str | None, str | None]:
+    row = db.session.execute(
+        select(Post.id, Post.body_hash, Post.metadata_hash).where(Post.title == title)
+    ).first()
+
+    return tuple(row) if row else (None, None, None)
+
+
+def save_post(
+    post: PostFile, old_title: str | None = None
+) -> tuple[Post | None, list[str]]:
+    # Stage the post, or its update when a post with the old title exists.
+
+    author = get_author(post.author)
+    if not author:
+        message = f"No user was found to own {post}."
+        logger.error(message)
+        return None, [message]
+
+    old_post = Post.query.filter_by(title=old_title or post.title).first()
+    if old_post and is_unchanged(post, old_post.body_hash, old_post.metadata_hash):
+        logger.debug(f"Post {post} is unchanged.")
+        return old_post, []
+
+    category = get_category(post.category)
+
+    # A post whose body is unchanged was not rendered again.
+    if not post.html and not old_post:
+        post = get_render("post")(post)
+    rendered = bool(post.html)
+
+    items = dict(
+        title=post.title,
+        content=post.html if rendered else old_post.content,
+        published=post.published,
+        slug=title_to_url(post.title).lower(),
+        meta_title=post.title,
+        author=author,
+        category=category,
+        summary=post.summary,
+        toc=post.toc if rendered else old_post.toc,
+        body_hash=post.body_hash,
+        metadata_hash=post.metadata_hash,
+    )
+
+    if old_post:
+        return old_post.update(**items), []
+
+    return Post.create(**items), []
+
+
+def prune_category(category: Category) -> None:
+    if category.posts:
+        return None
+
+    logger.info(f"Deleted empty category {category.title}.")
+    category.delete()
+
+
+def remove_post(title: str) -> Post | None:
+    old_post = Post.query.filter_by(title=title).first()
+    if not old_post:
+        return None
+
+    category = old_post.category
+    old_post.delete()
+    db.session.expire(category, ["posts"])
+    prune_category(category)
+
+    return old_post
+
+
+def to_worktree_path(path: str) -> Path:
+    return OwnerProfile.WORKTREE.joinpath(*path.split("/"))
+
+
+_cat_file: CatFile | None = None
+
+
+def read_blob(rev: str, path: str) -> str | None:
+    global _cat_file
+
+    if _cat_file is None:
+        _cat_file = CatFile(OwnerProfile.GITDIR)
+
+    data = _cat_file.read(rev, path)
+    if data is None:
+        return None
+
+    return data.decode("utf-8")
+
+
+def read_payload(payload: list | dict) -> list[dict]:
+    """Get changed files from what the git hook sent.
+
+    The hook sends either the list of changed files of the worktree, or the
+    revisions of the push as {"revs": [[oldrev, newrev], ...]}. Changed files
+    of revisions are read from git objects instead of the worktree. Raises
+    ValueError for anything else.
+    """
+
+    if isinstance(payload, dict):
+        changes: list[dict] = []
+        for oldrev, newrev in payload.get("revs", []):
+            changes.extend(diff_name_status(OwnerProfile.GITDIR, oldrev, newrev))
+        return changes
+
+    if not isinstance(payload, list) or not all(
+        isinstance(change, dict) for change in payload
+    ):
+        raise ValueError("Changed files or revisions were expected.")
+
+    return payload
+
+
+def apply_changes(changes: list[dict]) -> list[dict]:
+    """Apply the changed files of a push in one transaction.
+
+    Every change is a dict of the git diff mode and a list of paths relative to
+    the worktree, plus the revision to read them from if they come from git
+    objects. Files are loaded and validated before anything is written, so
+    a broken file only fails itself; a database error rolls back the batch.
+    """
+
+    results: list[dict] = []
+    loaded: list[tuple[dict, PostFile | None]] = []
+
+    if any(PROFILE_PATH in (change.get("path") or []) for change in changes):
+        OwnerProfile.invalidate()
+
+    for change in changes:
+        mode: str = (change.get("mode") or "").upper()[:1]
+        paths: list[str] = change.get("path") or []
+        result = dict(mode=mode, path=paths, status="pending", messages=[])
+        results.append(result)
+
+        if not paths or mode not in ("A", "M", "R", "C", "T", "D"):
+            result.update(status="failed", messages=["Invalid change."])
+            continue
+
+        if mode == "D":
+            loaded.append((result, None))
+            continue
+
+        text = None
+        if change.get("rev"):
+            text = read_blob(change["rev"], paths[-1])
+            if text is None:
+                result.update(status="failed", messages=["Blob was not found."])
+                continue
+
+        path = to_worktree_path(paths[-1])
+        post, messages = load_post(path, text=text, render=False)
+        if messages:
+            result.update(status="failed", messages=messages)
+            continue
+
+        if not post:
+            result.update(status="skipped")
+            continue
+
+        # Only render posts whose body changed, and skip untouched posts.
+        post_id, body_hash, metadata_hash = get_hashes(Path(paths[0]).stem)
+        if is_unchanged(post, body_hash, metadata_hash):
+            result.update(status="unchanged", id=post_id)
+            continue
+        if post.body_hash != body_hash:
+            post = get_render("post")(post)
+
+        loaded.append((result, post))
+
+    try:
+        with transaction():
+            apply_loaded(loaded)
+    except Exception as e:
+        logger.exception("Fail to apply changed files.")
+        for result, _ in loaded:
+            if result["status"] != "failed":
+                result.update(status="failed", messages=[f"Rolled back: {e}."])
+            result.pop("id", None)
+
+    return results
+
+
+def apply_loaded(loaded: list[tuple[dict, PostFile | None]]) -> None:
+    for result, post in loaded:
+        paths = result["path"]
+        old_title = Path(paths[0]).stem
+
+        if post is None:
+            old_post = remove_post(old_title)
+            result["status"] = "deleted" if old_post else "skipped"
+            continue
+
+        old_post = Post.query.filter_by(title=old_title).first()
+        old_category = old_post.category if old_post else None
+        new_post, messages = save_post(post, old_title=old_title)
+        if messages:
+            result.update(status="failed", messages=messages)
+            continue
+
+        result.update(status="updated" if old_post else "created", id=new_post.id)
+        if old_category and old_category is not new_post.category:
+            db.session.expire(old_category, ["posts"])
+            prune_category(old_category)
+
+
+def walk_posts(root: Path = PostFile.PATH_ROOT) -> list[Path]:
+    return sorted(root.rglob(f"*{PostFile.FILE_SUFFIX}"))
+
+
+def reindex(
+    paths: list[Path], workers: int | None = None, chunk_size: int = 100
+) -> tuple[int, dict[Path, list[str]]]:
+    """Load posts across a process pool and upsert them in chunked transactions.
+
+    Returns the number of saved posts and the error messages of every file that
+    could not be saved.
+    """
+
+    saved = 0
+    errors: dict[Path, list[str]] = {}
+    chunk: list[PostFile] = []
+
+    authors: dict[str, User | None] = {}
+
+    def upsert(posts: list[PostFile]) -> int:
+        categories = Category.upsert_many([post.category for post in posts])
+
+        items: list[dict] = []
+        for post in posts:
+            if post.author not in authors:
+                authors[post.author] = get_author(post.author)
+            author = authors[post.author]
+            if not author:
+                raise ValueError(f"No user was found to own {post}.")
+
+            items.append(
+                dict(
+                    title=post.title,
+                    content=post.html,
+                    summary=post.summary,
+                    toc=post.toc,
+                    created_at=get_local_datetime(author.timezone),
+                    published=post.published,
+                    slug=title_to_url(post.title).lower(),
+                    meta_title=post.title,
+                    body_hash=post.body_hash,
+                    metadata_hash=post.metadata_hash,
+                    author_id=author.id,
+                    category_id=categories[post.category],
+                )
+            )
+
+        # Posts whose hashes did not change are not written, nor counted.
+        return len(Post.upsert_many(items))
+
+    def flush() -> int:
+        try:
+            with transaction():
+                return upsert(chunk)
+        except Exception:
+            logger.warning("Fail to write chunk, retrying file by file.")
+
+        count = 0
+        for post in chunk:
+            try:
+                with transaction():
+                    count += upsert([post])
+            except Exception as e:
+                errors[post.path] = [f"Fail to save {post} with error {e}."]
+        return count
+
+    # Workers render with the cache of the app, they have no app of their own.
+    cache = get_render_cache()
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=use_render_cache,
+        initargs=(cache.path, cache.max_size) if cache else (None,),
+    ) as executor:
+        results = executor.map(load_post, paths, chunksize=16)
+        for path, (post, messages) in zip(paths, results):
+            if messages:
+                errors[path] = messages
+                continue
+
+            if not post:
+                continue
+
+            chunk.append(post)
+            if len(chunk) >= chunk_size:
+                saved += flush()
+                chunk.clear()
+
+    if chunk:
+        saved += flush()
+
+    return saved, errors
@@ -0,0 +1,337 @@
+"""
+Summary: Persistent ingest job queue drained by background worker threads.
+Created: 2023-12-12
+Author: Gao Tianchi
+"""
+
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from flask import Flask, current_app
+from sqlalchemy import Select, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .flaskexten import db
+from .ingest import apply_changes, read_payload
+from .model.database import Job, Task, transaction, utcnow
+
+logger = logging.getLogger("root.jobqueue")
+
+
+def get_key(change: dict) -> str:
+    # Changes are coalesced by the path they leave behind in the worktree.
+    paths: list[str] = change.get("path") or [""]
+    return paths[-1]
+
+
+def enqueue(changes: list[dict], key: str | None = None) -> Job:
+    """Store the changed files of a push as a job and wake up the workers.
+
+    A change to a path which still waits in the queue supersedes the waiting
+    task, so repeated edits of one post are rendered only once. A push which
+    is delivered again with the same idempotency key returns the first job.
+    """
+
+    if key:
+        job = Job.query.filter_by(idempotency_key=key).first()
+        if job:
+            logger.info(f"Changes with key {key} were already queued as {job}.")
+            return job
+
+    keys = [get_key(change) for change in changes]
+    waiting_tasks: dict[str, Task] = {
+        task.key: task
+        for task in Task.query.filter(
+            Task.status == "pending", Task.key.in_(keys)
+        ).all()
+    }
+
+    superseded: set[int] = set()
+    try:
+        with transaction():
+            job = Job(status="pending", created_at=datetime.now(), idempotency_key=key)
+            db.session.add(job)
+
+            for change, task_key in zip(changes, keys):
+                mode: str = (change.get("mode") or "").upper()[:1]
+                path: list[str] = change.get("path") or []
+                rev: str | None = change.get("rev")
+
+                waiting: Task | None = waiting_tasks.get(task_key)
+                if waiting:
+                    # A rename still has to drop the post under its old title.
+                    if waiting.mode == "R" and mode in ("A", "M", "T"):
+                        mode, path = waiting.mode, json.loads(waiting.path)
+                        rev = rev or waiting.rev
+                    elif waiting.mode == "R" and mode == "D":
+                        # Keyed by the old path, so a new file at the path
+                        # does not supersede the deletion.
+                        path = json.loads(waiting.path)[:1]
+                        task_key = get_key(dict(path=path))
+                    waiting.status = "coalesced"
+                    superseded.add(waiting.job_id)
+                    logger.debug(f"Coalesced {waiting} into the new job.")
+
+                db.session.add(
+                    Task(
+                        job=job,
+                        mode=mode,
+                        path=json.dumps(path),
+                        rev=rev,
+                        key=task_key,
+                        status="pending",
+                    )
+                )
+    except IntegrityError:
+        # Another process queued the same delivery in the meantime.
+        return Job.query.filter_by(idempotency_key=key).one()
+    logger.info(f"Enqueued {job} with {len(changes)} changed files.")
+    if superseded:
+        finish_jobs(superseded)
+
+    worker: IngestWorker | None = current_app.extensions.get("ingest_worker")
+    if worker:
+        worker.notify()
+
+    return job
+
+
+def park(record_path: Path, reason: str) -> None:
+    # Move a record which can never be queued out of the way of later pushes.
+
+    dead = record_path.parent.joinpath("dead")
+    dead.mkdir(parents=True, exist_ok=True)
+    os.replace(record_path, dead.joinpath(record_path.name))
+    logger.error(
+        f"Parked spooled changes {record_path.name} in {dead}: {reason}. "
+        "Move the file back to the spool to replay it."
+    )
+
+
+def drain_spool(spool: Path, attempts: int, delay: float) -> int:
+    """Queue the changes the hook could not deliver, oldest push first.
+
+    A record is removed only after it was queued. A record which is broken or
+    names revisions git does not know is parked in the dead directory of the
+    spool. Other failures are retried with exponential backoff; if a record
+    still fails, draining stops so that later pushes are never applied
+    before earlier ones.
+    """
+
+    drained = 0
+    for record_path in sorted(spool.glob("*.json")):
+        try:
+            text = record_path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            # Delivered by the hook or another process.
+            continue
+
+        try:
+            record: dict = json.loads(text)
+            changes = read_payload(record["payload"])
+            key: str = record["key"]
+        except (KeyError, TypeError, ValueError, subprocess.CalledProcessError) as e:
+            park(record_path, str(e) or type(e).__name__)
+            continue
+
+        for attempt in range(attempts):
+            try:
+                enqueue(changes, key=key)
+                break
+            except Exception as e:
+                db.session.rollback()
+                wait = delay * 2**attempt
+                logger.warning(
+                    f"Fail to queue {record_path.name}: {e}. Retry in {wait}s."
+                )
+                time.sleep(wait)
+        else:
+            logger.error(f"Gave up draining the spool at {record_path.name}.")
+            return drained
+
+        record_path.unlink(missing_ok=True)
+        drained += 1
+        logger.info(f"Replayed spooled changes {record_path.name}.")
+
+    return drained
+
+
+def requeue_stale(timeout: float) -> int:
+    """Put running tasks whose lease ran out back in the queue.
+
+    A worker which crashed or a process which was stopped leaves its tasks
+    running, and they would block every later change to their paths. Applying
+    a change twice is harmless, so a slow worker only costs some work.
+    """
+
+    deadline = utcnow() - timedelta(seconds=timeout)
+    with transaction():
+        result = db.session.execute(
+            update(Task)
+            .where(
+                Task.status == "running",
+                or_(Task.claimed_at.is_(None), Task.claimed_at < deadline),
+            )
+            .values(status="pending", claimed_at=None)
+        )
+
+    if result.rowcount:
+        logger.warning(f"Requeued {result.rowcount} stale running tasks.")
+    return result.rowcount
+
+
+def get_claimable(limit: int) -> Select:
+    # The oldest waiting tasks whose path is not being applied elsewhere.
+    running = select(Task.key).where(Task.status == "running")
+    return (
+        select(Task)
+        .where(Task.status == "pending", Task.key.not_in(running))
+        .order_by(Task.id.asc())
+        .limit(limit)
+    )
+
+
+def claim(limit: int) -> list[Task]:
+    requeue_stale(current_app.config["INGEST_LEASE_TIMEOUT"])
+
+    candidates = db.session.scalars(get_claimable(limit)).all()
+
+    claimed: list[Task] = []
+    with transaction():
+        for task in candidates:
+            result = db.session.execute(
+                update(Task)
+                .where(Task.id == task.id, Task.status == "pending")
+                .values(status="running", claimed_at=utcnow())
+            )
+            if result.rowcount:
+                claimed.append(task)
+
+    return claimed
+
+
+def finish_jobs(job_ids: set[int]) -> None:
+    with transaction():
+        for job in Job.query.filter(Job.id.in_(job_ids)).all():
+            statuses = set(
+                db.session.scalars(select(Task.status).where(Task.job_id == job.id))
+            )
+            if statuses & {"pending", "running"}:
+                continue
+            job.status = "done"
+            job.finished_at = datetime.now()
+            logger.info(f"Finished {job}.")
+
+
+def run_once(limit: int) -> int:
+    tasks = claim(limit)
+    if not tasks:
+        return 0
+
+    # Mark the jobs as started before the slow part.
+    with transaction():
+        for job in {task.job for task in tasks}:
+            if job.status == "pending":
+                job.status = "running"
+
+    changes = [
+        dict(mode=task.mode, path=json.loads(task.path), rev=task.rev) for task in tasks
+    ]
+    try:
+        results = apply_changes(changes)
+    except Exception as e:
+        logger.exception("Fail to apply claimed tasks.")
+        results = [dict(status="failed", messages=[str(e)]) for _ in tasks]
+
+    with transaction():
+        for task, result in zip(tasks, results):
+            task.status = result["status"]
+            task.result = json.dumps(result)
+
+    finish_jobs({task.job_id for task in tasks})
+
+    return len(tasks)
+
+
+class IngestWorker:
+    """A small pool of daemon threads draining the ingest queue."""
+
+    def __init__(self, workers: int, batch_size: int, poll_interval: float) -> None:
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.threads: list[threading.Thread] = []
+
+    def start(self, app: Flask) -> None:
+        with self.lock:
+            if self.threads:
+                return None
+
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self.run,
+                    args=(app, i == 0),
+                    name=f"ingest-{i}",
+                    daemon=True,
+                )
+                thread.start()
+                self.threads.append(thread)
+            logger.info(f"Started {self.workers} ingest workers.")
+
+    def notify(self) -> None:
+        self.event.set()
+
+    def run(self, app: Flask, drain: bool = False) -> None:
+        with app.app_context():
+            if drain:
+                try:
+                    drain_spool(
+                        app.config["PATH_SPOOL"],
+                        app.config["SPOOL_RETRY_ATTEMPTS"],
+                        app.config["SPOOL_RETRY_DELAY"],
+                    )
+                except Exception:
+                    logger.exception("Fail to drain the spool.")
+                finally:
+                    db.session.remove()
+
+            while True:
+                try:
+                    count = run_once(self.batch_size)
+                except Exception:
+                    logger.exception("Ingest worker failed.")
+                    db.session.rollback()
+                    count = 0
+                finally:
+                    db.session.remove()
+
+                if count:
+                    continue
+
+                self.event.wait(self.poll_interval)
+                self.event.clear()
+
+
+def init_app(app: Flask) -> None:
+    worker = IngestWorker(
+        workers=app.config["INGEST_WORKERS"],
+        batch_size=app.config["INGEST_BATCH_SIZE"],
+        poll_interval=app.config["INGEST_POLL_INTERVAL"],
+    )
+    app.extensions["ingest_worker"] = worker
+
+    # Only a process which serves requests runs the workers. Flask commands
+    # such as initdb or reindex must not have threads touching the database.
+    @app.before_request
+    def start_worker() -> None:
+        if worker.workers and not worker.threads:
+            if current_app.config["INGEST_START_WORKERS"]:
+                worker.start(app)
@@ -0,0 +1,146 @@
+"""
+Summary: Reconcile the database with the worktree through a persisted manifest.
+Created: 2023-12-17
+Author: Gao Tianchi
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from sqlalchemy import select
+
+from .flaskexten import db
+from .ingest import apply_changes, remove_post
+from .model.database import ManifestEntry, Post, transaction
+from .model.fileitem import OwnerProfile, PostFile
+
+logger = logging.getLogger("root.manifest")
+
+
+def scan_worktree(root: Path | None = None) -> dict[str, tuple[float, int]]:
+    # Stat every post below root, keyed by its path relative to the worktree.
+
+    root = root or PostFile.PATH_ROOT
+    stats: dict[str, tuple[float, int]] = {}
+    prefix = root.relative_to(OwnerProfile.WORKTREE).as_posix()
+    stack: list[tuple[str, str]] = [(str(root), prefix)]
+
+    while stack:
+        dirpath, relpath = stack.pop()
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                name = f"{relpath}/{entry.name}"
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, name))
+                elif entry.name.endswith(PostFile.FILE_SUFFIX):
+                    stat = entry.stat()
+                    stats[name] = (stat.st_mtime, stat.st_size)
+
+    return stats
+
+
+def hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def sync(prune: bool = False) -> dict:
+    """Bring the database in line with the worktree.
+
+    Only files whose mtime or size differ from the manifest are read; of
+    those, only files whose content hash changed are ingested. A new file
+    with the content of a missing one is a rename, which keeps the post and
+    its comments, as a push does. A file whose post was deleted some other
+    way is ingested again. Posts of missing files and posts which no file of
+    the worktree maps to are reported, and deleted only when prune is set.
+    """
+
+    stats = scan_worktree()
+    entries: dict[str, ManifestEntry] = {
+        entry.path: entry for entry in ManifestEntry.query.all()
+    }
+    # Foreign keys are not enforced, so entries can outlive their posts.
+    post_ids: set[int] = set(db.session.scalars(select(Post.id)))
+
+    changes: list[dict] = []
+    touched: dict[str, str] = {}
+    for path, (mtime, size) in stats.items():
+        entry = entries.get(path)
+        lost = bool(entry and entry.post_id and entry.post_id not in post_ids)
+        if entry and not lost and entry.mtime == mtime and entry.size == size:
+            continue
+
+        content_hash = hash_file(OwnerProfile.WORKTREE.joinpath(path))
+        unchanged = entry and entry.content_hash == content_hash
+        if unchanged and entry.post_id and not lost:
+            entry.mtime = mtime
+            continue
+
+        changes.append(dict(mode="M" if entry else "A", path=[path]))
+        touched[path] = content_hash
+
+    missing = [path for path in entries if path not in stats]
+    moved: dict[str, list[str]] = {}
+    for path in missing:
+        moved.setdefault(entries[path].content_hash, []).append(path)
+
+    for change in changes:
+        new_path = change["path"][0]
+        old_paths = moved.get(touched[new_path])
+        if change["mode"] == "A" and old_paths:
+            change.update(mode="R", path=[old_paths.pop(0), new_path])
+
+    renamed = {change["path"][0] for change in changes if change["mode"] == "R"}
+    missing = [path for path in missing if path not in renamed]
+    removed = missing if prune else []
+    changes.extend(dict(mode="D", path=[path]) for path in removed)
+
+    results = apply_changes(changes) if changes else []
+
+    with transaction():
+        for result in results:
+            path = result["path"][-1]
+            if result["status"] == "failed":
+                continue
+
+            if result["mode"] == "D":
+                db.session.delete(entries[path])
+                continue
+
+            if result["mode"] == "R":
+                db.session.delete(entries[result["path"][0]])
+
+            post = PostFile(OwnerProfile.WORKTREE.joinpath(path))
+            mtime, size = stats[path]
+            entry = entries.get(path) or ManifestEntry(path=path)
+            entry.mtime = mtime
+            entry.size = size
+            entry.content_hash = touched[path]
+            entry.front_matter = json.dumps(post.metadata, default=str)
+            entry.post_id = result.get("id")
+            db.session.add(entry)
+
+    tracked = select(ManifestEntry.post_id).where(ManifestEntry.post_id.is_not(None))
+    orphans: list[Post] = Post.query.filter(Post.id.not_in(tracked)).all()
+    with transaction():
+        for post in orphans:
+            logger.warning(f"Post {post.title} has no file in the worktree.")
+            if prune:
+                remove_post(post.title)
+
+    return dict(
+        scanned=len(stats),
+        changed=len(changes) - len(removed),
+        renamed=len(renamed),
+        removed=len(removed),
+        missing=[] if prune else missing,
+        results=results,
+        orphans=[post.title for post in orphans],
+    )
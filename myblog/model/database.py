@@ -3,20 +3,134 @@ Created: 2023-11-20
 Author: Gao Tianchi
 """
 
+import json
 import logging
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterator
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, String, Text
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from markupsafe import Markup, escape
+from sqlalchemy import (
+    DDL,
+    Boolean,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+)
+from sqlalchemy import (
+    Connection,
+    Select,
+    Update,
+    case,
+    column,
+    delete,
+    event,
+    func,
+    literal_column,
+    or_,
+    select,
+    table,
+    text,
+    true,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import (
+    Mapped,
+    Session,
+    joinedload,
+    load_only,
+    mapped_column,
+    relationship,
+)
+from sqlalchemy.orm.attributes import set_committed_value
 
 from myblog.flaskexten import db
-from myblog.utlis import get_local_datetime, get_username
+from myblog.utlis import (
+    DateTimeEncoder,
+    get_local_datetime,
+    get_username,
+    title_to_url,
+)
 
 logger = logging.getLogger("model.database")
 
 from werkzeug.security import check_password_hash, generate_password_hash
 
 
+def change_count(column, id: int | None, delta: int) -> None:
+    # Add to a counter in SQL, so concurrent writers never lose an update.
+    # Loaded objects get the new value too.
+
+    if not id or not delta:
+        return None
+
+    model = column.class_
+    db.session.execute(
+        update(model).where(model.id == id).values({column: column + delta})
+    )
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def to_month(column):
+    # The format is a literal, not a parameter, so SQLite can match the
+    # expression to ix_post_published_month.
+    return func.strftime(text("'%Y-%m'"), column)
+
+
+def touch(model, *conditions) -> None:
+    # Move the change version of the matching rows on. Conditional GETs
+    # compare it, so anything a page shows must touch the rows it is keyed by.
+    # The rows are also named in the session, for the page cache to drop
+    # their pages once the transaction is committed.
+
+    ids = db.session.scalars(
+        update(model)
+        .where(*conditions)
+        .values(version=model.version + 1, changed_at=utcnow())
+        .returning(model.id)
+    ).all()
+
+    table = model.__tablename__
+    changed: set[str] = db.session.info.setdefault("changed", set())
+    changed.add(table)
+    changed.update(f"{table}:{id}" for id in ids)
+
+
+@contextmanager
+def transaction() -> Iterator:
+    """Commit everything staged inside the block once, or nothing at all.
+
+    Model methods only add to the session; the outermost block commits. A
+    nested block is a SAVEPOINT: an exception rolls back what the block wrote,
+    and the outer block goes on if the caller catches it.
+    """
+
+    depth: int = db.session.info.get("transaction_depth", 0)
+    db.session.info["transaction_depth"] = depth + 1
+    try:
+        if depth:
+            with db.session.begin_nested():
+                yield db.session
+        else:
+            yield db.session
+            db.session.commit()
+    except Exception:
+        if not depth:
+            db.session.rollback()
+        raise
+    finally:
+        db.session.info["transaction_depth"] = depth
+
+
 class Blog(db.Model):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     title: Mapped[str] = mapped_column(String(255), default="My personal blog")
@@ -24,6 +138,10 @@ class Blog(db.Model):
     language: Mapped[str] = mapped_column(String(255), default="en-us")
     link: Mapped[str] = mapped_column(String(255), nullable=True)
     description: Mapped[str] = mapped_column(String(255), nullable=True)
+    published_count: Mapped[int] = mapped_column(Integer, default=0)
+    # Changes with any post or category, for pages which list many posts.
+    version: Mapped[int] = mapped_column(Integer, default=0)
+    changed_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow)
 
     owner = relationship("User", back_populates="blog")
 
@@ -31,9 +149,8 @@ class Blog(db.Model):
     def create(cls) -> "Blog":
         new_blog = Blog()
         db.session.add(new_blog)
-        db.session.commit()
 
-        return Blog.query.get(new_blog.id)
+        return new_blog
 
     def update(
         self, title=None, subtitle=None, language=None, link=None, description=None
@@ -44,12 +161,13 @@ class Blog(db.Model):
         self.link = link
         self.description = description
         db.session.add(self)
-        db.session.commit()
-        return Blog.query.get(self.id)
+        owners = select(User.id).where(User.blog_id == self.id)
+        change_posts(Post.author_id.in_(owners))
+        touch(Blog)
+        return self
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
 
     def to_dict(self):
         return dict(
@@ -66,7 +184,7 @@ class User(db.Model):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String(255))
     username: Mapped[str] = mapped_column(String(255))
-    email: Mapped[str] = mapped_column(String(255))
+    email: Mapped[str] = mapped_column(String(255), unique=True, index=True)
     password_hash: Mapped[str] = mapped_column(String(255))
     registered_at: Mapped[datetime] = mapped_column(DateTime)
     last_login: Mapped[datetime] = mapped_column(DateTime)
@@ -100,8 +218,7 @@ class User(db.Model):
             blog=blog,
         )
         db.session.add(new_user)
-        db.session.commit()
-        return User.query.get(new_user.id)
+        return new_user
 
     def update_information(
         self, name, username, timezone=None, intro=None, detail=None
@@ -113,30 +230,28 @@ class User(db.Model):
         self.timezone = timezone if timezone else self.timezone
 
         db.session.add(self)
-        db.session.commit()
+        change_posts(Post.author_id == self.id)
+        touch(Blog)
 
     def delete(self):
-        blog_id = self.blog_id
+        blog = self.blog
         db.session.delete(self)
-        db.session.commit()
-
-        blog = Blog.query.get(blog_id)
-        blog.delete()
+        if blog:
+            blog.delete()
 
     def update_activity(self):
         self.last_login = get_local_datetime(self.timezone)
         db.session.add(self)
-        db.session.commit()
+        change_posts(Post.author_id == self.id)
 
     def update_email(self, new_email: str):
         self.email = new_email
         db.session.add(self)
-        db.session.commit()
+        change_posts(Post.author_id == self.id)
 
     def update_password(self, new_password: str):
         self.password_hash = generate_password_hash(new_password)
         db.session.add(self)
-        db.session.commit()
 
     def validate_password(self, password: str) -> bool:
         return check_password_hash(self.password_hash, password)
@@ -160,22 +275,41 @@ class User(db.Model):
 
 
 class Post(db.Model):
+    __table_args__ = (
+        Index("ix_post_category_id_published_at", "category_id", "published_at"),
+    )
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    title: Mapped[str] = mapped_column(String(255))
-    content: Mapped[str] = mapped_column(Text)
-    summary: Mapped[str] = mapped_column(Text, nullable=True)
-    toc: Mapped[str] = mapped_column(Text, nullable=True)
+    title: Mapped[str] = mapped_column(String(255), unique=True, index=True)
+    # Rendered HTML is loaded on first access, or by undefer_group("body") on
+    # the pages which show it, so lists of posts stay light.
+    content: Mapped[str] = mapped_column(Text, deferred=True, deferred_group="body")
+    summary: Mapped[str] = mapped_column(Text, nullable=True, deferred=True)
+    toc: Mapped[str] = mapped_column(
+        Text, nullable=True, deferred=True, deferred_group="body"
+    )
     created_at: Mapped[datetime] = mapped_column(DateTime)
     updated_at: Mapped[datetime] = mapped_column(DateTime)
     published: Mapped[bool] = mapped_column(Boolean)
-    published_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
-    slug: Mapped[str] = mapped_column(String(255))
+    published_at: Mapped[datetime] = mapped_column(DateTime, nullable=True, index=True)
+    slug: Mapped[str] = mapped_column(String(255), index=True)
     meta_title: Mapped[str] = mapped_column(String(255))
+    body_hash: Mapped[str] = mapped_column(String(64), nullable=True)
+    metadata_hash: Mapped[str] = mapped_column(String(64), nullable=True)
+    comment_count: Mapped[int] = mapped_column(Integer, default=0)
+    # Changes with the post, its comments and what it embeds.
+    version: Mapped[int] = mapped_column(Integer, default=0)
+    changed_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow)
+    # The JSON of to_dict, served as it is by the API. Write paths refresh it.
+    document: Mapped[bytes] = mapped_column(LargeBinary, nullable=True, deferred=True)
     author_id: Mapped[int] = mapped_column(Integer, ForeignKey("user.id"))
     category_id: Mapped[int] = mapped_column(Integer, ForeignKey("category.id"))
 
     author = relationship("User", back_populates="posts")
     category = relationship("Category", back_populates="posts")
+    comments = relationship(
+        "Comment", back_populates="post", cascade="all, delete-orphan"
+    )
 
     @classmethod
     def create(
@@ -189,6 +323,8 @@ class Post(db.Model):
         category,
         summary=None,
         toc=None,
+        body_hash=None,
+        metadata_hash=None,
     ) -> "Post":
         created_at = get_local_datetime(author.timezone)
         published_at = created_at if published else None
@@ -203,12 +339,18 @@ class Post(db.Model):
             published_at=published_at,
             slug=slug,
             meta_title=meta_title,
+            body_hash=body_hash,
+            metadata_hash=metadata_hash,
             author=author,
             category=category,
         )
         db.session.add(new_post)
-        db.session.commit()
-        return Post.query.get(new_post.id)
+        db.session.flush()
+        Post.__count(new_post.__counted(), 1)
+        new_post.document = new_post.to_json()
+        index_posts(Post.id == new_post.id)
+        touch(Blog)
+        return new_post
 
     def update(
         self,
@@ -221,8 +363,11 @@ class Post(db.Model):
         category,
         summary=None,
         toc=None,
+        body_hash=None,
+        metadata_hash=None,
     ) -> "Post":
         updated_at = get_local_datetime(author.timezone)
+        counted = self.__counted()
         if self.published:
             published_at = self.published_at
         elif published:
@@ -239,17 +384,119 @@ class Post(db.Model):
         self.published_at = published_at
         self.slug = slug
         self.meta_title = meta_title
+        self.body_hash = body_hash
+        self.metadata_hash = metadata_hash
         self.author = author
         self.category = category
 
         db.session.add(self)
-        db.session.commit()
-
-        return Post.query.get(self.id)
+        if counted != self.__counted():
+            Post.__count(counted, -1)
+            Post.__count(self.__counted(), 1)
+        self.document = self.to_json()
+        index_posts(Post.id == self.id)
+        touch(Post, Post.id == self.id)
+        touch(Blog)
+        return self
 
     def delete(self):
+        Post.__count(self.__counted(), -1)
+        db.session.execute(delete(post_search).where(post_search.c.rowid == self.id))
+        # Drops the cached page of the post along with the lists.
+        touch(Post, Post.id == self.id)
         db.session.delete(self)
-        db.session.commit()
+        db.session.flush()
+        touch(Blog)
+
+    def __counted(self) -> tuple[bool, int | None, int | None]:
+        category_id = self.category.id if self.category else self.category_id
+        blog_id = self.author.blog_id if self.author else None
+        return bool(self.published), category_id, blog_id
+
+    @staticmethod
+    def __count(counted: tuple[bool, int | None, int | None], delta: int) -> None:
+        # Published posts count towards their category and blog.
+        published, category_id, blog_id = counted
+        if published:
+            change_count(Category.post_count, category_id, delta)
+            change_count(Blog.published_count, blog_id, delta)
+
+    @classmethod
+    def upsert_many(cls, items: list[dict]) -> dict[str, int]:
+        """Insert or update many posts in one statement, keyed by title.
+
+        Every item holds the columns of a post with author_id and category_id,
+        plus the local time of the write as created_at. Rows whose hashes did
+        not change are left alone. Returns the ids of the written posts.
+        """
+
+        if not items:
+            return {}
+
+        rows = [
+            dict(
+                item,
+                updated_at=item["created_at"],
+                published_at=item["created_at"] if item["published"] else None,
+            )
+            for item in items
+        ]
+        statement = insert(Post).values(rows)
+        excluded = statement.excluded
+        statement = statement.on_conflict_do_update(
+            index_elements=[Post.title],
+            set_=dict(
+                content=excluded.content,
+                summary=excluded.summary,
+                toc=excluded.toc,
+                updated_at=excluded.updated_at,
+                published=excluded.published,
+                # Keep the first publication time, as Post.update does.
+                published_at=case(
+                    (Post.published, Post.published_at),
+                    else_=excluded.published_at,
+                ),
+                slug=excluded.slug,
+                meta_title=excluded.meta_title,
+                body_hash=excluded.body_hash,
+                metadata_hash=excluded.metadata_hash,
+                author_id=excluded.author_id,
+                category_id=excluded.category_id,
+            ),
+            where=or_(
+                Post.body_hash.is_distinct_from(excluded.body_hash),
+                Post.metadata_hash.is_distinct_from(excluded.metadata_hash),
+            ),
+        ).returning(Post.id, Post.title)
+
+        written = {title: id for id, title in db.session.execute(statement)}
+        if written:
+            # Rows were written behind the back of the counters.
+            recount(["category", "blog"])
+            change_posts(Post.id.in_(written.values()))
+            index_posts(Post.id.in_(written.values()))
+            touch(Blog)
+
+        return written
+
+    @classmethod
+    def count_by_month(cls) -> list[tuple[int, int, int]]:
+        # (year, month, count) of published posts, oldest month first.
+
+        # Grouped in the order of ix_post_published_month, with no sorting.
+        month = to_month(Post.published_at)
+        statement = (
+            select(month, func.count())
+            .where(Post.published == true(), month.is_not(None))
+            .group_by(month)
+            .order_by(month)
+        )
+
+        counts: list[tuple[int, int, int]] = []
+        for value, count in db.session.execute(statement):
+            year, month_number = value.split("-")
+            counts.append((int(year), int(month_number), count))
+        return counts
 
     def to_dict(self) -> dict:
         return dict(
@@ -268,16 +515,61 @@ class Post(db.Model):
             author=self.author.to_dict(),
         )
 
+    def to_json(self) -> bytes:
+        data = json.dumps(self.to_dict(), cls=DateTimeEncoder, ensure_ascii=False)
+        return data.encode("utf-8")
+
     def __repr__(self) -> str:
         return f"<Post {self.title}>"
 
 
+# The months of published posts, for the date archive.
+Index(
+    "ix_post_published_month",
+    to_month(Post.published_at),
+    sqlite_where=Post.published == true(),
+)
+
+# Full-text index of published posts, keyed by the id of the post. FTS5 keeps
+# its own copy of the text, so searches never read Post.content.
+post_search = table(
+    "post_search",
+    column("rowid", Integer),
+    column("title", Text),
+    column("summary", Text),
+    column("body", Text),
+    column("rank", Float),
+)
+
+
+def create_search_table(connection: Connection) -> None:
+    connection.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS post_search USING fts5("
+        "title, summary, body, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    # Matches in titles weigh most and matches in bodies least. Ordering by
+    # rank, FTS5 sorts the results itself.
+    connection.exec_driver_sql(
+        "INSERT INTO post_search (post_search, rank) "
+        "VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')"
+    )
+
+
+event.listen(
+    Post.__table__,
+    "after_create",
+    lambda target, connection, **kw: create_search_table(connection),
+)
+event.listen(Post.__table__, "before_drop", DDL("DROP TABLE IF EXISTS post_search"))
+
+
 class Category(db.Model):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    title: Mapped[str] = mapped_column(String(255))
+    title: Mapped[str] = mapped_column(String(255), unique=True, index=True)
     content: Mapped[str] = mapped_column(Text, nullable=True)
     slug: Mapped[str] = mapped_column(String(255))
     meta_title: Mapped[str] = mapped_column(String(255))
+    post_count: Mapped[int] = mapped_column(Integer, default=0)
 
     posts = relationship("Post", back_populates="category")
 
@@ -290,9 +582,9 @@ class Category(db.Model):
             content=content,
         )
         db.session.add(new_category)
-        db.session.commit()
-
-        return Category.query.get(new_category.id)
+        db.session.flush()
+        touch(Blog)
+        return new_category
 
     def update(self, title, slug, meta_title, content=None) -> "Category":
         self.title = title
@@ -300,20 +592,57 @@ class Category(db.Model):
         self.meta_title = meta_title
         self.content = content
         db.session.add(self)
-        db.session.commit()
-        return Category.query.get(self.id)
+        change_posts(Post.category_id == self.id)
+        touch(Blog)
+        return self
+
+    @classmethod
+    def upsert_many(cls, titles: list[str]) -> dict[str, int]:
+        # Get the ids of many categories, creating the missing ones at once.
+
+        titles = list(dict.fromkeys(titles))
+        if not titles:
+            return {}
+
+        categories: dict[str, int] = dict(
+            db.session.execute(
+                select(Category.title, Category.id).where(Category.title.in_(titles))
+            ).all()
+        )
+        missing = [title for title in titles if title not in categories]
+        if not missing:
+            return categories
+
+        statement = insert(Category).values(
+            [
+                dict(title=title, slug=title_to_url(title).lower(), meta_title=title)
+                for title in missing
+            ]
+        )
+        # A no-op update, so that rows another process created are returned too.
+        statement = statement.on_conflict_do_update(
+            index_elements=[Category.title], set_=dict(title=statement.excluded.title)
+        ).returning(Category.id, Category.title)
+
+        categories.update((title, id) for id, title in db.session.execute(statement))
+        touch(Blog)
+        return categories
 
     def delete(self) -> None:
         default_category = Category.query.first()
         if self is default_category:
             logger.warning(f"Cannot delete default category!!!")
             return None
+        moved = [post.id for post in self.posts]
         for post in self.posts:
             post.category = default_category
             db.session.add(post)
-        db.session.commit()
+        db.session.flush()
+        change_posts(Post.id.in_(moved))
+        change_count(Category.post_count, default_category.id, self.post_count)
         db.session.delete(self)
-        db.session.commit()
+        db.session.flush()
+        touch(Blog)
 
     def to_dict(self) -> dict:
         return dict(
@@ -326,13 +655,26 @@ class Category(db.Model):
 
 
 class Comment(db.Model):
+    __table_args__ = (
+        Index("ix_comment_post_id_timestamp", "post_id", "timestamp"),
+        Index("ix_comment_post_id_path", "post_id", "path"),
+    )
+
+    # Ids in a path are padded, so sorting by path sorts a thread depth first.
+    PATH_WIDTH: int = 10
+    PATH_SEPARATOR: str = "/"
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     from_owner: Mapped[bool] = mapped_column(Boolean, default=False)
-    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.today())
+    timestamp: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.now, index=True
+    )
+    # Ids of the comment and all comments it replies to, root first.
+    path: Mapped[str] = mapped_column(Text, nullable=True)
 
-    # post = relationship("Post", back_populates="comments")
-    # post_id: Mapped[int] = mapped_column(Integer, ForeignKey("post.id"))
+    post = relationship("Post", back_populates="comments")
+    post_id: Mapped[int] = mapped_column(Integer, ForeignKey("post.id"), nullable=True)
 
     reply_to = relationship("Comment", back_populates="reply_me", remote_side=[id])
     reply_to_id: Mapped[int] = mapped_column(
@@ -345,33 +687,354 @@ class Comment(db.Model):
 
     @classmethod
     def create(cls, content, post_id, reply_to_id=None, from_owner=False) -> "Comment":
+        reply_to = db.session.get(Comment, reply_to_id) if reply_to_id else None
+        if reply_to and reply_to.post_id != post_id:
+            logger.warning(f"Comment {reply_to} is not on post {post_id}.")
+            reply_to = None
+
         new_item = Comment(
             content=content,
             post_id=post_id,
-            reply_to_id=reply_to_id,
+            reply_to=reply_to,
             from_owner=from_owner,
         )
         db.session.add(new_item)
-        db.session.commit()
+        db.session.flush()
+        new_item.path = Comment.make_path(new_item.id, reply_to)
+        change_count(Post.comment_count, post_id, 1)
+        touch(Post, Post.id == post_id)
 
-        new_item = Comment.query.get(new_item.id)
         logger.info(f"Created new comment {new_item}")
         return new_item
 
     def modify(self, content) -> "Comment":
         self.content = content
-
         db.session.add(self)
-        db.session.commit()
+        touch(Post, Post.id == self.post_id)
 
-        new_item = Comment.query.get(self.id)
         logger.info(f"Modified comment {self}")
-        return new_item
+        return self
 
     def delete(self) -> None:
-        logger.info(f"Deleted comment {self}")
-        db.session.delete(self)
-        db.session.commit()
+        # Replies are deleted along with the comment, in one statement.
+        result = db.session.execute(
+            delete(Comment).where(
+                or_(
+                    Comment.id == self.id,
+                    Comment.path.startswith(self.path + Comment.PATH_SEPARATOR),
+                )
+            ),
+            execution_options=dict(synchronize_session="fetch"),
+        )
+        change_count(Post.comment_count, self.post_id, -result.rowcount)
+        touch(Post, Post.id == self.post_id)
+        logger.info(f"Deleted comment {self} with {result.rowcount - 1} replies")
+
+    @property
+    def depth(self) -> int:
+        return self.path.count(Comment.PATH_SEPARATOR)
+
+    @staticmethod
+    def make_path(id: int, reply_to: "Comment | None" = None) -> str:
+        path = str(id).zfill(Comment.PATH_WIDTH)
+        if reply_to:
+            path = reply_to.path + Comment.PATH_SEPARATOR + path
+        return path
+
+    @classmethod
+    def load_thread(cls, post_id: int) -> list["Comment"]:
+        """Load every comment of a post in one query, in thread order.
+
+        Each comment comes right after the one it replies to. reply_to and
+        reply_me are filled in while walking the rows once, so reading them
+        never queries the database.
+        """
+
+        comments: list[Comment] = (
+            Comment.query.filter_by(post_id=post_id).order_by(Comment.path).all()
+        )
+
+        by_id: dict[int, Comment] = {}
+        replies: dict[int, list[Comment]] = {}
+        for comment in comments:
+            by_id[comment.id] = comment
+            replies[comment.id] = []
+            parent = by_id.get(comment.reply_to_id)
+            if parent:
+                replies[parent.id].append(comment)
+            set_committed_value(comment, "reply_to", parent)
+
+        for comment in comments:
+            set_committed_value(comment, "reply_me", replies[comment.id])
+
+        return comments
 
     def __repr__(self) -> str:
         return f"<Comment {self.id}>"
+
+
+def get_recounts() -> dict[str, Update]:
+    # Statements which set every counter which drifted from the real count.
+
+    published = Post.published.is_(True)
+    post_count = (
+        select(func.count(Post.id))
+        .where(Post.category_id == Category.id, published)
+        .scalar_subquery()
+    )
+    comment_count = (
+        select(func.count(Comment.id))
+        .where(Comment.post_id == Post.id)
+        .scalar_subquery()
+    )
+    published_count = (
+        select(func.count(Post.id))
+        .join(User, Post.author_id == User.id)
+        .where(User.blog_id == Blog.id, published)
+        .scalar_subquery()
+    )
+
+    return dict(
+        category=update(Category)
+        .where(Category.post_count != post_count)
+        .values(post_count=post_count),
+        post=update(Post)
+        .where(Post.comment_count != comment_count)
+        .values(comment_count=comment_count),
+        blog=update(Blog)
+        .where(Blog.published_count != published_count)
+        .values(published_count=published_count),
+    )
+
+
+def recount(names: list[str] | None = None) -> dict[str, int]:
+    """Repair the denormalized counters, returning how many rows were off."""
+
+    fixed: dict[str, int] = {}
+    for name, statement in get_recounts().items():
+        if names and name not in names:
+            continue
+        result = db.session.execute(
+            statement, execution_options=dict(synchronize_session=False)
+        )
+        fixed[name] = result.rowcount
+    db.session.expire_all()
+
+    return fixed
+
+
+def refresh_documents(condition, session: Session | None = None) -> int:
+    """Regenerate the stored JSON of the posts matching condition.
+
+    Run after a change to anything a post embeds, such as its category or
+    author. Returns how many posts were refreshed.
+    """
+
+    # Only what to_dict reads, so that migrations older than the columns
+    # of the models can run this too.
+    session = session or db.session
+    statement = (
+        select(Post)
+        .where(condition)
+        .options(
+            load_only(
+                Post.title,
+                Post.content,
+                Post.summary,
+                Post.toc,
+                Post.created_at,
+                Post.updated_at,
+                Post.published,
+                Post.published_at,
+                Post.slug,
+                Post.meta_title,
+            ),
+            joinedload(Post.category),
+            joinedload(Post.author)
+            .joinedload(User.blog)
+            .load_only(
+                Blog.title, Blog.subtitle, Blog.language, Blog.link, Blog.description
+            ),
+        )
+    )
+    posts = session.scalars(statement).unique().all()
+    for post in posts:
+        post.document = post.to_json()
+
+    return len(posts)
+
+
+def index_posts(condition, session: Session | None = None) -> int:
+    """Write the search rows of the posts matching condition again.
+
+    Run in the transaction of every write to the title, summary, content or
+    publication of posts. Drafts are left out of the index. Returns how many
+    of the posts are searchable.
+    """
+
+    session = session or db.session
+    session.execute(
+        delete(post_search).where(
+            post_search.c.rowid.in_(select(Post.id).where(condition))
+        )
+    )
+
+    rows = session.execute(
+        select(Post.id, Post.title, Post.summary, Post.content).where(
+            condition, Post.published == true()
+        )
+    ).all()
+    if rows:
+        session.execute(
+            insert(post_search),
+            [
+                dict(
+                    rowid=id,
+                    title=title,
+                    summary=summary,
+                    body=Markup(content or "").striptags(),
+                )
+                for id, title, summary, content in rows
+            ],
+        )
+
+    return len(rows)
+
+
+def rebuild_search(session: Session | None = None) -> int:
+    # Index every post from scratch, for a broken or missing index.
+
+    session = session or db.session
+    session.execute(delete(post_search))
+    count = index_posts(true(), session)
+    session.execute(text("INSERT INTO post_search (post_search) VALUES ('optimize')"))
+    return count
+
+
+# Bounds of the matched words in snippets, which become <mark> once escaped.
+SNIPPET_MARKS: tuple[str, str] = ("\x02", "\x03")
+
+
+def search_query(terms: str) -> Select:
+    """Select the published posts matching every word of terms, best first.
+
+    Words are quoted, so the syntax of FTS5 queries is searched as text.
+    """
+
+    match = " ".join('"{}"'.format(word.replace('"', '""')) for word in terms.split())
+    index = literal_column("post_search")
+    return (
+        select(
+            Post.id,
+            Post.title,
+            Post.published_at,
+            func.snippet(index, -1, *SNIPPET_MARKS, "…", 24).label("snippet"),
+        )
+        .select_from(post_search)
+        .join(Post, Post.id == post_search.c.rowid)
+        .where(index.op("MATCH")(match))
+        .order_by(post_search.c.rank)
+    )
+
+
+def search_posts(terms: str, page: int, per_page: int) -> tuple[list[dict], bool]:
+    # A page of results, numbered from 1, and whether there are more.
+
+    if not terms.split():
+        return [], False
+
+    statement = search_query(terms).limit(per_page + 1).offset((page - 1) * per_page)
+    rows = db.session.execute(statement).all()
+
+    start, end = SNIPPET_MARKS
+    results = [
+        dict(
+            id=row.id,
+            title=row.title,
+            published_at=row.published_at,
+            snippet=escape(row.snippet)
+            .replace(start, Markup("<mark>"))
+            .replace(end, Markup("</mark>")),
+        )
+        for row in rows[:per_page]
+    ]
+    return results, len(rows) > per_page
+
+
+def change_posts(condition) -> None:
+    # Posts changed along with something they embed, such as their category.
+    touch(Post, condition)
+    refresh_documents(condition)
+
+
+class Job(db.Model):
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    status: Mapped[str] = mapped_column(String(32), default="pending")
+    created_at: Mapped[datetime] = mapped_column(DateTime)
+    finished_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    idempotency_key: Mapped[str] = mapped_column(String(64), nullable=True, unique=True)
+
+    tasks = relationship("Task", back_populates="job", order_by="Task.id")
+
+    def to_dict(self) -> dict:
+        progress: dict = {}
+        for task in self.tasks:
+            progress[task.status] = progress.get(task.status, 0) + 1
+
+        return dict(
+            id=self.id,
+            status=self.status,
+            idempotency_key=self.idempotency_key,
+            created_at=self.created_at,
+            finished_at=self.finished_at,
+            total=len(self.tasks),
+            progress=progress,
+            tasks=[task.to_dict() for task in self.tasks],
+        )
+
+    def __repr__(self) -> str:
+        return f"<Job {self.id}>"
+
+
+class Task(db.Model):
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    job_id: Mapped[int] = mapped_column(Integer, ForeignKey("job.id"))
+    mode: Mapped[str] = mapped_column(String(8))
+    path: Mapped[str] = mapped_column(Text)
+    key: Mapped[str] = mapped_column(String(255), index=True)
+    rev: Mapped[str] = mapped_column(String(40), nullable=True)
+    status: Mapped[str] = mapped_column(String(32), default="pending", index=True)
+    result: Mapped[str] = mapped_column(Text, nullable=True)
+    # When a worker took the task; running tasks without it are stale.
+    claimed_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+    job = relationship("Job", back_populates="tasks")
+
+    def to_dict(self) -> dict:
+        return dict(
+            id=self.id,
+            mode=self.mode,
+            path=json.loads(self.path),
+            rev=self.rev,
+            status=self.status,
+            result=json.loads(self.result) if self.result else None,
+        )
+
+    def __repr__(self) -> str:
+        return f"<Task {self.id} {self.mode} {self.key}>"
+
+
+class ManifestEntry(db.Model):
+    __tablename__ = "manifest"
+
+    path: Mapped[str] = mapped_column(String(1024), primary_key=True)
+    mtime: Mapped[float] = mapped_column(Float)
+    size: Mapped[int] = mapped_column(Integer)
+    content_hash: Mapped[str] = mapped_column(String(64))
+    front_matter: Mapped[str] = mapped_column(Text, nullable=True)
+    post_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("post.id", ondelete="SET NULL"), nullable=True
+    )
+
+    def __repr__(self) -> str:
+        return f"<ManifestEntry {self.path}>"
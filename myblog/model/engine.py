@@ -0,0 +1,57 @@
+"""
+Summary: Tune SQLite connections of an engine as they are opened.
+Created: 2023-12-20
+Author: Gao Tianchi
+"""
+
+import logging
+
+from sqlalchemy import Engine, event
+
+logger = logging.getLogger("model.engine")
+
+
+def apply_pragmas(engine: Engine, pragmas: dict[str, str | int]) -> None:
+    """Run the pragmas on every new connection of the engine.
+
+    Most pragmas only last as long as the connection, so they are set in the
+    connect event rather than once at start up. journal_mode=WAL is stored in
+    the database file, setting it again is a no-op.
+    """
+
+    if not pragmas or engine.dialect.name != "sqlite":
+        return None
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+    logger.debug(f"Set pragmas {pragmas} on {engine.url}.")
+
+
+def emit_begin(engine: Engine) -> None:
+    """Begin SQLite transactions from SQLAlchemy rather than from the driver.
+
+    pysqlite only opens a transaction right before a write, so a SAVEPOINT
+    emitted first opens one of its own, and releasing it commits. With the
+    driver's own handling turned off, BEGIN is emitted when the session
+    begins, and nested transaction() blocks can be rolled back alone.
+    """
+
+    if engine.dialect.name != "sqlite":
+        return None
+
+    @event.listens_for(engine, "connect")
+    def disable_driver_begin(dbapi_connection, connection_record) -> None:
+        dbapi_connection.isolation_level = None
+
+    # Straight on the driver connection, as pysqlite did, so that BEGIN is
+    # not counted among the queries of a request.
+    @event.listens_for(engine, "begin")
+    def begin(connection) -> None:
+        connection.connection.dbapi_connection.execute("BEGIN")
@@ -3,10 +3,14 @@ Created: 2023-12-02
 Author: Gao Tianchi
 """
 
-
+import hashlib
 import json
 import logging
+import mmap
+import os
 import re
+import threading
+import time
 from datetime import date, datetime
 from pathlib import Path
 
@@ -19,14 +23,67 @@ logger = logging.getLogger("model.fileitem")
 
 
 class OwnerProfile:
+    """The owner's profile.json, cached once per process.
+
+    The file is checked with a cheap stat() at most once per CHECK_INTERVAL
+    seconds and only read again when its mtime or size changed. Every value
+    the templates use is computed once per load.
+    """
+
     GITDIR: Path = config.PATH_GITDIR
     WORKTREE: Path = config.PATH_WORKTREE
+    CHECK_INTERVAL: float = config.PROFILE_CHECK_INTERVAL
+
+    _lock = threading.Lock()
+    _loaded: dict | None = None
+    _signature: tuple[int, int] | None = None
+    _checked_at: float = 0.0
 
     def __init__(self) -> None:
-        self.data = self.__read_profile()
+        self.__fields: dict = self.load()
+        self.data: dict = self.__fields["data"]
+
+    @classmethod
+    def load(cls) -> dict:
+        now = time.monotonic()
+        if cls._loaded is not None and now - cls._checked_at < cls.CHECK_INTERVAL:
+            return cls._loaded
+
+        with cls._lock:
+            signature = cls.__stat()
+            if cls._loaded is None or signature != cls._signature:
+                cls._loaded = cls.__compute(cls.__read_profile())
+                cls._signature = signature
+                logger.debug("Loaded owner profile.")
+            cls._checked_at = now
+
+        return cls._loaded
+
+    @classmethod
+    def get_signature(cls) -> tuple[int, int] | None:
+        # The mtime and size of the profile as last loaded.
+        cls.load()
+        return cls._signature
+
+    @classmethod
+    def invalidate(cls) -> None:
+        # Called when a push changes profile.json.
+        with cls._lock:
+            cls._loaded = None
+            cls._signature = None
+
+    @classmethod
+    def __stat(cls) -> tuple[int, int] | None:
+        try:
+            stat = cls.WORKTREE.joinpath("profile.json").stat()
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
 
-    def __read_profile(self) -> dict:
-        path_profile: Path = self.WORKTREE.joinpath("profile.json")
+    @classmethod
+    def __read_profile(cls) -> dict:
+        path_profile: Path = cls.WORKTREE.joinpath("profile.json")
 
         if not path_profile.exists():
             return {}
@@ -38,42 +95,54 @@ class OwnerProfile:
 
         return profile
 
+    @staticmethod
+    def __compute(data: dict) -> dict:
+        website: dict = data.get("website", {})
+
+        created_date = website.get("created_date")
+        if created_date:
+            created_date = datetime.strptime(created_date, "%Y-%m-%d").date()
+        else:
+            created_date = date.today()
+
+        return dict(
+            data=data,
+            name=data.get("name", "owner name"),
+            email=data.get("email", "owner email"),
+            blog_title=website.get("blog_title", "blog title"),
+            language=website.get("language", "en-us"),
+            link=website.get("link", "http://example.com"),
+            created_date=created_date,
+            description=website.get("description", "website description"),
+        )
+
     @property
     def name(self) -> str:
-        return self.data.get("name", "owner name")
+        return self.__fields["name"]
 
     @property
     def email(self) -> str:
-        return self.data.get("email", "owner email")
+        return self.__fields["email"]
 
     @property
     def blog_title(self) -> str:
-        website: dict = self.data.get("website", {})
-        return website.get("blog_title", "blog title")
+        return self.__fields["blog_title"]
 
     @property
     def language(self) -> str:
-        website: dict = self.data.get("website", {})
-        return website.get("language", "en-us")
+        return self.__fields["language"]
 
     @property
     def link(self) -> str:
-        website: dict = self.data.get("website", {})
-        return website.get("link", "http://example.com")
+        return self.__fields["link"]
 
     @property
     def created_date(self) -> date:
-        website: dict = self.data.get("website", {})
-        d = website.get("created_date")
-        if not d:
-            d = date.today()
-        d = datetime.strptime(d, "%Y-%m-%d").today()
-        return d
+        return self.__fields["created_date"]
 
     @property
     def description(self) -> str:
-        website: dict = self.data.get("website", {})
-        return website.get("description", "website description")
+        return self.__fields["description"]
 
 
 class PostFile:
@@ -90,20 +159,40 @@ class PostFile:
     AUTHOR_KEY_NAME: str = "author"
     CATEGORY_KEY_NAME: str = "category"
     SUMMARY_KEY_NAME: str = "summary"
-
-    def __init__(self, path: Path) -> None:
+    PUBLISHED_KEY_NAME: str = "published"
+
+    # Files larger than this are scanned through a memory map.
+    MMAP_THRESHOLD: int = 1024 * 1024
+    FRONT_MATTER_DELIMITER: bytes = b"---"
+
+    __slots__ = (
+        "path",
+        "title",
+        "text",
+        "metadata",
+        "html",
+        "toc",
+        "__body",
+        "__body_offset",
+    )
+
+    def __init__(self, path: Path, text: str | None = None) -> None:
         self.path = path
         self.title = self.path.stem
+        self.text = text
 
         if self.is_post():
-            self.content = self.path.read_text(encoding="utf-8")
             self.metadata = self.__read_metadata()
-            self.body = self.__read_body()
+            self.__body = None
             self.html = ""
             self.toc = None
 
+    def read_text(self) -> str:
+        return self.path.read_text(encoding="utf-8")
+
     def is_post(self) -> bool:
-        if not self.path.is_file():
+        # Posts read from git objects have no file in the worktree.
+        if self.text is None and not self.path.is_file():
             logger.error(f"{self.path} is not a file.")
             return False
 
@@ -119,16 +208,51 @@ class PostFile:
 
         return True
 
-    def __read_metadata(self) -> dict:
-        pattern = re.compile(r"---\n(.*?)\n---", re.DOTALL)
-        match = pattern.match(self.content)
+    def __split(self, head: bytes | mmap.mmap) -> tuple[bytes, int]:
+        # Find the yaml field and the offset where the body starts.
+        delimiter = self.FRONT_MATTER_DELIMITER
+        if head[: len(delimiter) + 1] != delimiter + b"\n":
+            return b"", 0
+
+        start = len(delimiter) + 1
+        end = head.find(b"\n" + delimiter, start - 1)
+        if end == -1:
+            return b"", 0
+
+        body_offset = head.find(b"\n", end + 1)
+        body_offset = len(head) if body_offset == -1 else body_offset + 1
+
+        return head[start:end], body_offset
+
+    def __read_front_matter(self) -> bytes:
+        if self.text is not None:
+            yaml_content, self.__body_offset = self.__split(self.text.encode("utf-8"))
+            return yaml_content
+
+        with self.path.open("rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > self.MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    yaml_content, self.__body_offset = self.__split(mm)
+                    return yaml_content
+
+            # Only read lines up to the end of the yaml field.
+            head = f.readline()
+            if head.rstrip(b"\r\n") == self.FRONT_MATTER_DELIMITER:
+                for line in f:
+                    head += line
+                    if line.startswith(self.FRONT_MATTER_DELIMITER):
+                        break
+
+        yaml_content, self.__body_offset = self.__split(head)
+        return yaml_content
 
-        if not match:
-            return {}
+    def __read_metadata(self) -> dict:
+        yaml_content: str = self.__read_front_matter().decode("utf-8").strip()
 
-        yaml_content: str = match.group(1)
         if not yaml_content:
-            logger.warning(f"Post {self.path} has empty yaml filed.")
+            if self.__body_offset:
+                logger.warning(f"Post {self.path} has empty yaml filed.")
             return {}
 
         try:
@@ -144,10 +268,26 @@ class PostFile:
             return metadata
 
     def __read_body(self) -> str:
-        pattern = re.compile(r"---.*?---", re.DOTALL)
-        body: str = re.sub(pattern, "", self.content).strip()
+        if self.text is not None:
+            data: bytes = self.text.encode("utf-8")[self.__body_offset :]
+            return data.decode("utf-8").strip()
+
+        with self.path.open("rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > self.MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return mm[self.__body_offset :].decode("utf-8").strip()
 
-        return body
+            f.seek(self.__body_offset)
+            return f.read().decode("utf-8").strip()
+
+    @property
+    def body(self) -> str:
+        # The body is only read when it is needed, e.g. to render the post.
+        if self.__body is None:
+            self.__body = self.__read_body()
+
+        return self.__body
 
     @property
     def author(self) -> str:
@@ -173,6 +313,15 @@ class PostFile:
         logger.debug(f"Using default category name {self.CATEGORY_DEFAULT_NAME}")
         return self.CATEGORY_DEFAULT_NAME
 
+    @property
+    def published(self) -> bool:
+        published_in_metadata: bool | None = self.metadata.get(self.PUBLISHED_KEY_NAME)
+
+        if published_in_metadata is None:
+            return True
+
+        return bool(published_in_metadata)
+
     @property
     def summary(self) -> str:
         summary_in_metadata: str | None = self.metadata.get(self.SUMMARY_KEY_NAME)
@@ -188,5 +337,29 @@ class PostFile:
 
         return default_summary
 
+    @property
+    def body_hash(self) -> str:
+        # Trailing whitespace does not change the rendered post, except for the
+        # two spaces of a markdown line break.
+        lines: list[str] = []
+        for line in self.body.splitlines():
+            stripped = line.rstrip()
+            if line.endswith("  "):
+                stripped += "  "
+            lines.append(stripped)
+
+        return hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
+
+    @property
+    def metadata_hash(self) -> str:
+        # Title and category also come from the path of the post.
+        data = json.dumps(
+            dict(title=self.title, category=self.category, metadata=self.metadata),
+            sort_keys=True,
+            default=str,
+        )
+
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
     def __repr__(self) -> str:
         return f"<Post {self.path.stem}>"
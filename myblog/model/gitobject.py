@@ -0,0 +1,93 @@
+"""
+Summary: Read changed files straight from the objects of the remote repository.
+Created: 2023-12-15
+Author: Gao Tianchi
+"""
+
+import logging
+import subprocess
+import threading
+from pathlib import Path
+
+logger = logging.getLogger("model.gitobject")
+
+ZERO_REV: str = "0" * 40
+EMPTY_TREE: str = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+
+def diff_name_status(gitdir: Path, oldrev: str, newrev: str) -> list[dict]:
+    # Get changed files between two revisions in the format of the git hook.
+
+    if newrev == ZERO_REV:
+        logger.info("The ref was deleted, nothing to ingest.")
+        return []
+
+    if oldrev == ZERO_REV:
+        oldrev = EMPTY_TREE
+
+    output: bytes = subprocess.check_output(
+        ["git", f"--git-dir={gitdir}", "diff", "--name-status", "-z", "-M"]
+        + [oldrev, newrev]
+    )
+    fields = output.decode("utf-8").split("\0")
+
+    changed_files: list[dict] = []
+    i = 0
+    while i < len(fields) and fields[i]:
+        mode = fields[i][0]
+        if mode in ("R", "C"):
+            path = fields[i + 1 : i + 3]
+            i += 3
+        else:
+            path = fields[i + 1 : i + 2]
+            i += 2
+        changed_files.append(dict(mode=mode, path=path, rev=newrev))
+
+    return changed_files
+
+
+class CatFile:
+    """A long-lived `git cat-file --batch` process for reading blobs."""
+
+    def __init__(self, gitdir: Path) -> None:
+        self.gitdir = gitdir
+        self.lock = threading.Lock()
+        self.process: subprocess.Popen | None = None
+
+    def __start(self) -> subprocess.Popen:
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(
+                ["git", f"--git-dir={self.gitdir}", "cat-file", "--batch"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+            logger.debug(f"Started git cat-file for {self.gitdir}.")
+
+        return self.process
+
+    def read(self, rev: str, path: str) -> bytes | None:
+        with self.lock:
+            process = self.__start()
+            process.stdin.write(f"{rev}:{path}\n".encode("utf-8"))
+            process.stdin.flush()
+
+            header = process.stdout.readline()
+            if header.endswith((b" missing\n", b" ambiguous\n")):
+                logger.error(f"Object {rev}:{path} is missing.")
+                return None
+
+            # Whatever the object is, its content follows and must be consumed.
+            _, kind, size = header.decode("utf-8").split()
+            data: bytes = process.stdout.read(int(size) + 1)[: int(size)]
+            if kind != "blob":
+                logger.error(f"Object {rev}:{path} is not a blob.")
+                return None
+
+        return data
+
+    def close(self) -> None:
+        with self.lock:
+            if self.process:
+                self.process.stdin.close()
+                self.process.wait()
+                self.process = None
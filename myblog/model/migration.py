@@ -0,0 +1,214 @@
+"""
+Summary: Versioned schema migrations, tracked in the user_version of SQLite.
+Created: 2023-12-19
+Author: Gao Tianchi
+"""
+
+import logging
+from typing import Callable
+
+from sqlalchemy import Connection, Index, inspect, true, update
+from sqlalchemy.orm import Session
+
+from myblog.flaskexten import db
+from myblog.model.database import (
+    Comment,
+    create_search_table,
+    get_recounts,
+    rebuild_search,
+    refresh_documents,
+    utcnow,
+)
+
+logger = logging.getLogger("model.migration")
+
+MIGRATIONS: list[tuple[str, Callable[[Connection], None]]] = []
+
+
+def migration(description: str):
+    # Append a migration; its version is its position in MIGRATIONS.
+
+    def decorator(func: Callable[[Connection], None]):
+        MIGRATIONS.append((description, func))
+        return func
+
+    return decorator
+
+
+def get_version(connection: Connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def set_version(connection: Connection, version: int) -> None:
+    connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def get_index(table: str, name: str) -> Index:
+    for index in db.metadata.tables[table].indexes:
+        if index.name == name:
+            return index
+
+    raise KeyError(f"No index {name} on table {table}.")
+
+
+def add_column(connection: Connection, table: str, name: str, ddl: str) -> None:
+    columns = {column["name"] for column in inspect(connection).get_columns(table)}
+    if name in columns:
+        return None
+
+    connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+    logger.info(f"Added column {table}.{name}.")
+
+
+def create_indexes(connection: Connection, table: str, names: list[str]) -> None:
+    for name in names:
+        get_index(table, name).create(connection, checkfirst=True)
+        logger.info(f"Created index {name}.")
+
+
+def drop_indexes(connection: Connection, names: list[str]) -> None:
+    for name in names:
+        connection.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+        logger.info(f"Dropped index {name}.")
+
+
+@migration("Create missing tables and the content hashes of posts.")
+def create_tables(connection: Connection) -> None:
+    # Tables which exist are left alone, so this only adds job queue tables
+    # and the manifest to databases created before them.
+    db.metadata.create_all(connection)
+
+    add_column(connection, "post", "body_hash", "VARCHAR(64)")
+    add_column(connection, "post", "metadata_hash", "VARCHAR(64)")
+
+
+@migration("Index hot lookup columns.")
+def index_lookups(connection: Connection) -> None:
+    create_indexes(
+        connection,
+        "post",
+        [
+            "ix_post_title",
+            "ix_post_slug",
+            "ix_post_published_at",
+        ],
+    )
+    create_indexes(connection, "category", ["ix_category_title"])
+    create_indexes(connection, "user", ["ix_user_email"])
+    create_indexes(connection, "comment", ["ix_comment_timestamp"])
+
+
+@migration("Link comments to their post.")
+def link_comments(connection: Connection) -> None:
+    add_column(connection, "comment", "post_id", "INTEGER REFERENCES post (id)")
+    create_indexes(connection, "comment", ["ix_comment_post_id_timestamp"])
+
+
+@migration("Count posts and comments on write.")
+def add_counters(connection: Connection) -> None:
+    add_column(connection, "category", "post_count", "INTEGER NOT NULL DEFAULT 0")
+    add_column(connection, "post", "comment_count", "INTEGER NOT NULL DEFAULT 0")
+    add_column(connection, "blog", "published_count", "INTEGER NOT NULL DEFAULT 0")
+
+    for statement in get_recounts().values():
+        connection.execute(statement)
+
+
+@migration("Store the thread path of comments.")
+def add_comment_paths(connection: Connection) -> None:
+    add_column(connection, "comment", "path", "TEXT")
+    create_indexes(connection, "comment", ["ix_comment_post_id_path"])
+
+    width, separator = Comment.PATH_WIDTH, Comment.PATH_SEPARATOR
+    sql = f"""
+        WITH RECURSIVE thread(id, path) AS (
+            SELECT id, printf('%0{width}d', id) FROM comment
+            WHERE reply_to_id IS NULL
+            UNION ALL
+            SELECT comment.id,
+                thread.path || '{separator}' || printf('%0{width}d', comment.id)
+            FROM comment JOIN thread ON comment.reply_to_id = thread.id
+        )
+        UPDATE comment SET path = (SELECT path FROM thread WHERE thread.id = comment.id)
+    """
+    connection.exec_driver_sql(sql)
+
+
+@migration("Index the pages of posts in a category.")
+def index_category_pages(connection: Connection) -> None:
+    create_indexes(connection, "post", ["ix_post_category_id_published_at"])
+
+
+@migration("Store the JSON of posts.")
+def add_post_documents(connection: Connection) -> None:
+    add_column(connection, "post", "document", "BLOB")
+
+    # The session joins the transaction of the migration.
+    with Session(connection) as session:
+        count = refresh_documents(true(), session)
+        session.flush()
+    logger.info(f"Stored the JSON of {count} posts.")
+
+
+@migration("Version posts and blogs for conditional requests.")
+def add_versions(connection: Connection) -> None:
+    for table in ["post", "blog"]:
+        add_column(connection, table, "version", "INTEGER NOT NULL DEFAULT 0")
+        add_column(connection, table, "changed_at", "DATETIME")
+        connection.execute(
+            update(db.metadata.tables[table]).values(changed_at=utcnow())
+        )
+
+
+@migration("Index the months of published posts.")
+def index_published_months(connection: Connection) -> None:
+    create_indexes(connection, "post", ["ix_post_published_month"])
+
+
+@migration("Add the full-text search index of posts.")
+def add_post_search(connection: Connection) -> None:
+    create_search_table(connection)
+    with Session(connection) as session:
+        rebuild_search(session)
+        session.flush()
+
+
+@migration("Lease claimed ingest tasks.")
+def add_task_leases(connection: Connection) -> None:
+    add_column(connection, "task", "claimed_at", "DATETIME")
+
+
+@migration("Drop indexes of posts by update time, which no query uses.")
+def drop_update_indexes(connection: Connection) -> None:
+    drop_indexes(connection, ["ix_post_updated_at", "ix_post_category_id_updated_at"])
+
+
+def upgrade() -> list[str]:
+    """Bring the schema of the database to the latest version in place.
+
+    An empty database gets the whole schema of the models at once. Otherwise
+    every migration newer than the stored version is applied in order, and the
+    version is stored after each of them, so a failed upgrade resumes where
+    it stopped. Returns the descriptions of what was applied.
+    """
+
+    latest = len(MIGRATIONS)
+    with db.engine.begin() as connection:
+        if not inspect(connection).get_table_names():
+            db.metadata.create_all(connection)
+            set_version(connection, latest)
+            logger.info(f"Created the schema at version {latest}.")
+            return [f"Created the schema at version {latest}."]
+
+        version = get_version(connection)
+
+    applied: list[str] = []
+    for number in range(version + 1, latest + 1):
+        description, func = MIGRATIONS[number - 1]
+        with db.engine.begin() as connection:
+            func(connection)
+            set_version(connection, number)
+        logger.info(f"Migrated the schema to version {number}: {description}")
+        applied.append(f"{number}: {description}")
+
+    return applied
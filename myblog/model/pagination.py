@@ -0,0 +1,108 @@
+"""
+Summary: Keyset pagination with opaque cursors.
+Created: 2023-12-22
+Author: Gao Tianchi
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from flask_sqlalchemy.query import Query
+from sqlalchemy import tuple_
+from sqlalchemy.orm import InstrumentedAttribute
+
+
+class Page:
+    """A page of items and the cursors of the pages around it."""
+
+    def __init__(self, items: list, next: str | None, prev: str | None) -> None:
+        self.items = items
+        self.next = next
+        self.prev = prev
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+def encode_cursor(direction: str, values: tuple) -> str:
+    values = [
+        value.isoformat() if isinstance(value, datetime) else value for value in values
+    ]
+    data = json.dumps([direction, values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(
+    cursor: str, keys: tuple[InstrumentedAttribute, ...]
+) -> tuple[str, tuple]:
+    # Raise ValueError for a cursor which this paginator did not make.
+
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, values = json.loads(data)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor {cursor}.") from e
+
+    if direction not in ("next", "prev") or len(values) != len(keys):
+        raise ValueError(f"Invalid cursor {cursor}.")
+
+    decoded = []
+    for key, value in zip(keys, values):
+        python_type = key.type.python_type
+        if python_type is datetime and isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if not isinstance(value, python_type):
+            raise ValueError(f"Invalid cursor {cursor}.")
+        decoded.append(value)
+
+    return direction, tuple(decoded)
+
+
+def paginate(
+    query: Query,
+    keys: tuple[InstrumentedAttribute, ...],
+    per_page: int,
+    cursor: str | None = None,
+    descending: bool = True,
+) -> Page:
+    """Get the page of the query which the cursor points at.
+
+    Rows are ordered by keys, which must be unique together, such as a
+    timestamp and the id. Instead of skipping rows with OFFSET, the page
+    starts right after the keys of the last row seen, so every page costs
+    as much as the first one given an index on the keys.
+    """
+
+    direction, values = decode_cursor(cursor, keys) if cursor else ("next", None)
+
+    # Walk backwards to get the page before the cursor.
+    forward = direction == "next"
+    ascending = forward != descending
+    if values:
+        position = tuple_(*keys)
+        bound = tuple_(*values)
+        query = query.filter(position > bound if ascending else position < bound)
+    query = query.order_by(*(key.asc() if ascending else key.desc() for key in keys))
+
+    rows = query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    items = rows[:per_page]
+    if not forward:
+        items.reverse()
+
+    def key_of(item) -> tuple:
+        return tuple(getattr(item, key.key) for key in keys)
+
+    has_next = more if forward else values is not None
+    has_prev = values is not None if forward else more
+
+    return Page(
+        items,
+        next=encode_cursor("next", key_of(items[-1])) if items and has_next else None,
+        prev=encode_cursor("prev", key_of(items[0])) if items and has_prev else None,
+    )
@@ -3,15 +3,224 @@ Created: 2023-11-21
 Author: Gao Tianchi
 """
 
+import atexit
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from multiprocessing.util import Finalize
+from pathlib import Path
 
+import markdown
+from flask import Flask, current_app, has_app_context
 from markdown import Markdown
 
 from .fileitem import PostFile
 
+logger = logging.getLogger("model.render")
+
+
+class RenderCache:
+    """Size-bounded LRU cache of rendered posts, persisted in SQLite.
+
+    Entries are keyed by a hash of the markdown body and the extension
+    configuration, so a re-push, rename or metadata-only edit of a post hits
+    the cache instead of running the markdown conversion again.
+
+    Reads are not written back one by one: the use times of entries and the
+    counters are kept in memory and written in a batch every FLUSH_EVERY
+    reads or FLUSH_INTERVAL seconds, and before anything is evicted.
+    """
+
+    FLUSH_EVERY: int = 64
+    FLUSH_INTERVAL: float = 30.0
+
+    def __init__(self, path: Path, max_size: int) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.used: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        self.flushed_at = time.monotonic()
+        self.__create_tables()
+
+    def __connect(self) -> closing[sqlite3.Connection]:
+        return closing(sqlite3.connect(self.path, timeout=10, isolation_level=None))
+
+    def __create_tables(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock, self.__connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS render ("
+                "key TEXT PRIMARY KEY, html TEXT NOT NULL, toc TEXT, "
+                "size INTEGER NOT NULL, used_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_render_used_at ON render (used_at)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats ("
+                "name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)"
+            )
+
+    @staticmethod
+    def make_key(md_text: str, options: dict) -> str:
+        h = hashlib.sha256()
+        h.update(markdown.__version__.encode("utf-8"))
+        h.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        h.update(b"\0")
+        h.update(md_text.encode("utf-8"))
+        return h.hexdigest()
+
+    def __count(self, conn: sqlite3.Connection, name: str, n: int = 1) -> None:
+        conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, n),
+        )
+
+    def __flush(self, conn: sqlite3.Connection) -> None:
+        if self.used or self.counts:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "UPDATE render SET used_at = ? WHERE key = ?",
+                [(used_at, key) for key, used_at in self.used.items()],
+            )
+            for name, n in self.counts.items():
+                self.__count(conn, name, n)
+            conn.execute("COMMIT")
+
+        self.used.clear()
+        self.counts.clear()
+        self.flushed_at = time.monotonic()
+
+    def flush(self) -> None:
+        if not (self.used or self.counts):
+            return None
+
+        with self.lock, self.__connect() as conn:
+            self.__flush(conn)
+
+    def get(self, key: str) -> tuple[str, str | None] | None:
+        with self.lock, self.__connect() as conn:
+            row = conn.execute(
+                "SELECT html, toc FROM render WHERE key = ?", (key,)
+            ).fetchone()
+            name = "hits" if row else "misses"
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if row:
+                self.used[key] = time.time()
+
+            if (
+                sum(self.counts.values()) >= self.FLUSH_EVERY
+                or time.monotonic() - self.flushed_at >= self.FLUSH_INTERVAL
+            ):
+                self.__flush(conn)
+
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, html: str, toc: str | None) -> None:
+        size = len(html.encode("utf-8")) + len((toc or "").encode("utf-8"))
+        if size > self.max_size:
+            logger.warning(f"Rendered post of {size} bytes is too large to cache.")
+            return None
+
+        with self.lock, self.__connect() as conn:
+            self.__flush(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO render (key, html, toc, size, used_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, html, toc, size, time.time()),
+            )
+            self.__evict(conn)
+
+    def __evict(self, conn: sqlite3.Connection) -> None:
+        total: int = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM render"
+        ).fetchone()[0]
+        if total <= self.max_size:
+            return None
+
+        evicted = 0
+        rows = conn.execute("SELECT key, size FROM render ORDER BY used_at ASC")
+        keys = []
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            keys.append((key,))
+            total -= size
+            evicted += 1
+
+        conn.executemany("DELETE FROM render WHERE key = ?", keys)
+        self.__count(conn, "evictions", evicted)
+        logger.info(f"Evicted {evicted} entries from the render cache.")
+
+    def stats(self) -> dict:
+        with self.lock, self.__connect() as conn:
+            self.__flush(conn)
+            stats = dict(hits=0, misses=0, evictions=0)
+            stats.update(conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM render"
+            ).fetchone()
+        stats.update(entries=entries, size=size, max_size=self.max_size)
+        return stats
+
+    def clear(self) -> None:
+        with self.lock, self.__connect() as conn:
+            self.used.clear()
+            self.counts.clear()
+            conn.execute("DELETE FROM render")
+            conn.execute("DELETE FROM stats")
+
+
+# The cache of a worker process, which has no app, see use_render_cache.
+_render_cache: RenderCache | None = None
+
+
+def use_render_cache(path: Path | None, max_size: int = 0) -> None:
+    """Open the render cache of the app in a process without an app context."""
+
+    global _render_cache
+
+    _render_cache = RenderCache(path, max_size) if path else None
+    if _render_cache:
+        # Pool processes end without atexit, but run the finalizers.
+        Finalize(_render_cache, _render_cache.flush, exitpriority=0)
+
+
+def get_render_cache() -> RenderCache | None:
+    # Forked pool processes also inherit the app context, with a copy of the
+    # cache of the app which would never be flushed.
+    if _render_cache or not has_app_context():
+        return _render_cache
+
+    return current_app.extensions.get("render_cache")
+
+
+def init_app(app: Flask) -> None:
+    if app.config["RENDER_CACHE_ENABLED"]:
+        cache = RenderCache(
+            app.config["PATH_RENDER_CACHE"], app.config["RENDER_CACHE_MAX_SIZE"]
+        )
+        atexit.register(cache.flush)
+        app.extensions["render_cache"] = cache
+
 
 class Post:
-    def __init__(self) -> None:
+    EXTENSIONS: list[str] = ["toc", "footnotes"]
+    EXTENSION_CONFIGS: dict = {"toc": {"baselevel": 2}}
+
+    # Markdown instances are expensive to build and are not thread safe, so
+    # every thread keeps its own and resets it between conversions.
+    local = threading.local()
+
+    def __init__(self, cache: RenderCache | None = None) -> None:
         self.toc = None
+        self.cache = cache
 
     def __call__(self, post: PostFile) -> PostFile:
         post.html = self.__convert(post.body)
@@ -19,19 +228,34 @@ class Post:
 
         return post
 
+    def __get_markdown(self) -> Markdown:
+        md: Markdown | None = getattr(self.local, "md", None)
+        if md is None:
+            md = Markdown(
+                extensions=self.EXTENSIONS,
+                extension_configs=self.EXTENSION_CONFIGS,
+            )
+            self.local.md = md
+
+        return md.reset()
+
     def __convert(self, md_text: str) -> str:
-        md = Markdown(
-            extensions=[
-                "toc",
-                "footnotes",
-            ],
-            extension_configs={
-                "toc": {
-                    "baselevel": 2,
-                },
-            },
-        )
+        key = None
+        if self.cache:
+            key = self.cache.make_key(
+                md_text,
+                dict(
+                    extensions=self.EXTENSIONS,
+                    extension_configs=self.EXTENSION_CONFIGS,
+                ),
+            )
+            cached = self.cache.get(key)
+            if cached:
+                logger.debug(f"Render cache hit for {key}.")
+                html_text, self.toc = cached
+                return html_text
 
+        md = self.__get_markdown()
         html_text = md.convert(md_text)
 
         empty_toc = """
@@ -43,6 +267,9 @@ class Post:
         if md.toc.strip() != empty_toc.strip():
             self.toc = md.toc
 
+        if self.cache:
+            self.cache.set(key, html_text, self.toc)
+
         return html_text
 
 
@@ -62,6 +289,6 @@ class Comment:
 def get_render(name: str):
     match name:
         case "post":
-            return Post()
+            return Post(cache=get_render_cache())
         case "comment":
             return Comment()
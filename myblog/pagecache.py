@@ -0,0 +1,279 @@
+"""
+Summary: Cache of whole visitor pages, invalidated by the writes which change them.
+Created: 2023-12-23
+Author: Gao Tianchi
+"""
+
+import functools
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Callable
+from urllib.parse import urlencode
+
+from flask import Flask, Response, current_app, has_app_context, request, session
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .model.fileitem import OwnerProfile
+
+logger = logging.getLogger("root.pagecache")
+
+# Every page carries this tag, so bumping it drops the whole cache.
+ALL: str = "*"
+
+
+class PageCache:
+    """Pages kept in memory and, optionally, in SQLite shared by processes.
+
+    Every page is stored with the generations of its tags, such as
+    "post:1" or "blog", as they were before the page was made. Writes bump
+    the generations of what they changed once they are committed, and a
+    page whose tags moved on is a miss. The shared file holds the
+    generations too, so a write in one process reaches every other one.
+    """
+
+    def __init__(self, max_entries: int, path: Path | None = None) -> None:
+        self.max_entries = max_entries
+        self.path = path
+        self.lock = threading.Lock()
+        self.pages: OrderedDict[str, dict] = OrderedDict()
+        self.fragments: dict[str, tuple[dict[str, int], Any]] = {}
+        self.generations: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self.__create_tables()
+
+    def __connect(self) -> closing[sqlite3.Connection]:
+        return closing(sqlite3.connect(self.path, timeout=10, isolation_level=None))
+
+    def __create_tables(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock, self.__connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS page ("
+                "key TEXT PRIMARY KEY, entry TEXT NOT NULL, body BLOB NOT NULL, "
+                "used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_page_used_at ON page (used_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tag ("
+                "name TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+            )
+
+    def get_generations(self, tags: list[str]) -> dict[str, int]:
+        if not self.path:
+            with self.lock:
+                return {tag: self.generations.get(tag, 0) for tag in tags}
+
+        with self.__connect() as conn:
+            rows = conn.execute(
+                f"SELECT name, generation FROM tag "
+                f"WHERE name IN ({', '.join('?' * len(tags))})",
+                tags,
+            ).fetchall()
+        return {tag: 0 for tag in tags} | dict(rows)
+
+    def get(self, key: str) -> dict | None:
+        with self.lock:
+            page = self.pages.get(key)
+            if page:
+                self.pages.move_to_end(key)
+
+        if not page and self.path:
+            with self.__connect() as conn:
+                row = conn.execute(
+                    "SELECT entry, body FROM page WHERE key = ?", (key,)
+                ).fetchone()
+            if row:
+                page = json.loads(row[0]) | dict(body=row[1])
+                self.__remember(key, page)
+
+        fresh = page and self.get_generations(list(page["tags"])) == page["tags"]
+        with self.lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return page if fresh else None
+
+    def set(self, key: str, response: Response, tags: dict[str, int]) -> None:
+        page = dict(
+            status=response.status_code,
+            headers=[
+                (name, value)
+                for name, value in response.headers.items()
+                if name.lower() not in ("set-cookie", "content-length")
+            ],
+            tags=tags,
+            body=response.get_data(),
+        )
+        self.__remember(key, page)
+
+        if not self.path:
+            return None
+
+        entry = json.dumps({name: page[name] for name in ("status", "headers", "tags")})
+        with self.__connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO page (key, entry, body, used_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, entry, page["body"], time.time()),
+            )
+            conn.execute(
+                "DELETE FROM page WHERE key IN ("
+                "SELECT key FROM page ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def __remember(self, key: str, page: dict) -> None:
+        with self.lock:
+            self.pages[key] = page
+            self.pages.move_to_end(key)
+            while len(self.pages) > self.max_entries:
+                self.pages.popitem(last=False)
+
+    def get_fragment(self, name: str, tags: list[str], make: Callable[[], Any]) -> Any:
+        # Fragments are kept by this process only, stamped like pages.
+
+        generations = self.get_generations(tags)
+        with self.lock:
+            fragment = self.fragments.get(name)
+        if fragment and fragment[0] == generations:
+            return fragment[1]
+
+        value = make()
+        with self.lock:
+            self.fragments[name] = (generations, value)
+        return value
+
+    def invalidate(self, tags: list[str]) -> None:
+        with self.lock:
+            for tag in tags:
+                self.generations[tag] = self.generations.get(tag, 0) + 1
+
+        if self.path:
+            with self.__connect() as conn:
+                conn.executemany(
+                    "INSERT INTO tag (name, generation) VALUES (?, 1) "
+                    "ON CONFLICT(name) DO UPDATE SET generation = generation + 1",
+                    [(tag,) for tag in tags],
+                )
+        logger.debug(f"Invalidated pages tagged {', '.join(sorted(tags))}.")
+
+    def clear(self) -> None:
+        self.invalidate([ALL])
+        with self.lock:
+            self.pages.clear()
+            self.fragments.clear()
+        if self.path:
+            with self.__connect() as conn:
+                conn.execute("DELETE FROM page")
+
+    def stats(self) -> dict:
+        entries = len(self.pages)
+        if self.path:
+            with self.__connect() as conn:
+                entries = conn.execute("SELECT COUNT(*) FROM page").fetchone()[0]
+        return dict(
+            entries=entries,
+            max_entries=self.max_entries,
+            hits=self.hits,
+            misses=self.misses,
+        )
+
+
+def get_page_cache() -> PageCache | None:
+    return current_app.extensions.get("page_cache")
+
+
+def get_fragment(name: str, tags: list[str], make: Callable[[], Any]) -> Any:
+    """Get a piece shared by many pages, such as the list of categories.
+
+    The value of make is kept until a write changes any of the tags, so it
+    must be plain data which does not need the session, not model objects.
+    """
+
+    cache = get_page_cache()
+    if not cache:
+        return make()
+
+    return cache.get_fragment(name, [ALL, *tags], make)
+
+
+def make_key() -> str:
+    # Equivalent URLs share a page: arguments are sorted and empty ones dropped.
+
+    args = sorted(
+        (name, value) for name, value in request.args.items(multi=True) if value
+    )
+    signature = OwnerProfile.get_signature()
+    return f"{request.path}?{urlencode(args)}#{signature}"
+
+
+def cache_page(get_tags: Callable[..., list[str]]):
+    """Serve the GET responses of an anonymous visitor view from the cache.
+
+    get_tags gets the arguments of the view and returns the tags of what
+    the page shows, which the writes of model.database name when they
+    change it.
+    """
+
+    def decorator(view: Callable):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            cache = get_page_cache()
+            if not cache or request.method not in ("GET", "HEAD") or session:
+                return view(**kwargs)
+
+            key = make_key()
+            page = cache.get(key)
+            if page:
+                response = current_app.response_class(
+                    page["body"], status=page["status"], headers=page["headers"]
+                )
+                return response.make_conditional(request)
+
+            # Taken before the view reads, so a write meanwhile makes it stale.
+            tags = cache.get_generations([ALL, *get_tags(**kwargs)])
+            response = current_app.make_response(view(**kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                cache.set(key, response, tags)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def invalidate_changed(session: Session) -> None:
+    # Once a commit is done, pages showing the rows it changed are stale.
+
+    tags = session.info.pop("changed", None)
+    if not tags or not has_app_context():
+        return None
+
+    cache = get_page_cache()
+    if cache:
+        cache.invalidate(sorted(tags))
+
+
+def forget_changed(session: Session) -> None:
+    session.info.pop("changed", None)
+
+
+def init_app(app: Flask) -> None:
+    if app.config["PAGE_CACHE_ENABLED"]:
+        app.extensions["page_cache"] = PageCache(
+            app.config["PAGE_CACHE_MAX_ENTRIES"], app.config["PATH_PAGE_CACHE"]
+        )
+
+    if not event.contains(Session, "after_commit", invalidate_changed):
+        event.listen(Session, "after_commit", invalidate_changed)
+        event.listen(Session, "after_rollback", forget_changed)
@@ -0,0 +1,136 @@
+"""
+Summary: Show how SQLite plans the queries of hot endpoints.
+Created: 2023-12-19
+Author: Gao Tianchi
+"""
+
+import logging
+from datetime import datetime
+from typing import Callable
+from urllib.parse import quote
+
+from flask import Flask
+from flask.testing import FlaskClient
+from sqlalchemy import event, select
+
+from .flaskexten import db
+from .ingest import get_hashes
+from .jobqueue import get_claimable
+from .model.database import Category, Post
+from .model.pagination import encode_cursor
+from .utlis import generate_token, title_to_url
+
+logger = logging.getLogger("root.queryplan")
+
+# Plan steps which read a whole table or sort rows outside of an index.
+SLOW_STEPS: tuple[str, ...] = ("SCAN", "USE TEMP B-TREE")
+
+# Small tables which are listed in full on purpose.
+WHOLE_TABLES: tuple[str, ...] = ("blog", "category")
+
+
+def get_workloads() -> dict[str, Callable[[FlaskClient], object]]:
+    """What each hot endpoint does, run on sample rows of the database.
+
+    Endpoints are requested through the test client, so the plans are of
+    the statements they really run. Nothing here writes to the database.
+    """
+
+    post = db.session.execute(
+        select(Post.id, Post.title, Post.slug).order_by(Post.id).limit(1)
+    ).first() or (1, "title", "slug")
+    category = db.session.scalar(select(Category.title).limit(1)) or "title"
+    # Later pages seek past the cursor, which is planned apart from the first.
+    cursor = encode_cursor("next", (datetime(2023, 12, 1), 1))
+
+    def owner(client: FlaskClient, url: str):
+        token = generate_token(client.application.config["SECRET_KEY"], b"gaotianchi")
+        with client.session_transaction() as session:
+            session["token"] = token.decode("utf-8")
+        return client.get(url)
+
+    return {
+        "api.read_post": lambda client: client.get(f"/api/read/post/{post.slug}"),
+        "api.list_posts": lambda client: client.get(f"/api/posts?cursor={cursor}"),
+        "api.list_comments": lambda client: client.get(
+            f"/api/read/post/{post.slug}/comments?cursor={cursor}"
+        ),
+        "visitor.read_post": lambda client: client.get(
+            f"/read/post/{post.id}/{title_to_url(post.title)}"
+        ),
+        "visitor.archive_post": lambda client: [
+            client.get(f"/archive/post?cursor={cursor}"),
+            client.get(f"/archive/post?category={title_to_url(category)}"),
+            client.get("/archive/post?from=2023-12-01&sort_by=oldest"),
+        ],
+        "visitor.search_post": lambda client: client.get(
+            f"/search?q={quote(post.title)}&page=2"
+        ),
+        "visitor.rss": lambda client: client.get("/rss"),
+        "account.sign_in": lambda client: client.post(
+            "/sign/in", data=dict(email="nobody@example.com", password="password")
+        ),
+        "owner.manage_comment": lambda client: owner(
+            client, f"/owner/manage/comment?cursor={cursor}"
+        ),
+        "ingest.get_hashes": lambda client: get_hashes(post.title),
+        "jobqueue.claim": lambda client: db.session.execute(get_claimable(200)).all(),
+    }
+
+
+def capture(app: Flask, work: Callable[[FlaskClient], object]) -> list[tuple]:
+    """Get the distinct reading statements which work runs, with parameters.
+
+    The page cache is left out while work runs, or cached pages would run
+    no query at all.
+    """
+
+    statements: dict[str, tuple] = {}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, *args) -> None:
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            statements.setdefault(statement, parameters)
+
+    page_cache = app.extensions.pop("page_cache", None)
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        work(app.test_client())
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        if page_cache:
+            app.extensions["page_cache"] = page_cache
+
+    return list(statements.items())
+
+
+def explain(statement: str, parameters: tuple) -> list[tuple[int, str]]:
+    """Get the steps of the query plan as (depth, detail), in plan order."""
+
+    rows = (
+        db.session.connection()
+        .exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        .all()
+    )
+
+    depths: dict[int, int] = {0: -1}
+    steps: list[tuple[int, str]] = []
+    for id, parent, _, detail in rows:
+        depths[id] = depths.get(parent, -1) + 1
+        steps.append((depths[id], detail))
+
+    return steps
+
+
+def is_slow(detail: str) -> bool:
+    if detail in (f"SCAN {table}" for table in WHOLE_TABLES):
+        return False
+
+    # A full-text MATCH reads the index of the virtual table.
+    if detail.startswith("SCAN") and "VIRTUAL TABLE INDEX" in detail:
+        return False
+
+    # Scanning a covering index is as good as a search for these tables.
+    if detail.startswith("SCAN") and "USING" in detail and "INDEX" in detail:
+        return False
+
+    return detail.startswith(SLOW_STEPS)
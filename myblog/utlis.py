@@ -5,7 +5,6 @@ Author: Gao Tianchi
 
 import json
 import re
-from collections import defaultdict
 from datetime import datetime
 
 import pytz
@@ -42,17 +41,3 @@ def generate_token(key: bytes, data: bytes) -> bytes:
     token: bytes = f.encrypt(data)
 
     return token
-
-
-def archive_post_by_date(posts: list) -> dict:
-    archive = defaultdict(dict)
-
-    for post in posts:
-        year = post.created.year
-        month = post.created.month
-
-        month_posts = archive[year].get(month, [])
-        month_posts.append(post)
-        archive[year][month] = month_posts
-
-    return archive
@@ -0,0 +1,158 @@
+"""
+Summary: Watch the worktree and ingest posts as they change on disk.
+Created: 2023-12-14
+Author: Gao Tianchi
+"""
+
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+from flask import Flask
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+
+from .flaskexten import db
+from .ingest import apply_changes
+from .model.fileitem import OwnerProfile, PostFile
+
+logger = logging.getLogger("root.watcher")
+
+
+class PostEventHandler(FileSystemEventHandler):
+    """Collect file system events per path and flush them after a quiet period.
+
+    Bursts of events for one file, such as an editor writing a temp file and
+    moving it over the post, end up as a single change in git diff terms.
+    """
+
+    def __init__(
+        self, worktree: Path, debounce: float, callback: Callable[[list], None]
+    ) -> None:
+        self.worktree = worktree
+        self.debounce = debounce
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.pending: dict[str, dict] = {}
+        self.timer: threading.Timer | None = None
+
+    def to_path(self, path: str) -> str | None:
+        path = Path(path)
+        if path.suffix != PostFile.FILE_SUFFIX:
+            return None
+
+        return path.relative_to(self.worktree).as_posix()
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        if event.is_directory:
+            return None
+
+        with self.lock:
+            match event.event_type:
+                case "created":
+                    self.__add(self.to_path(event.src_path), "A")
+                case "modified":
+                    self.__add(self.to_path(event.src_path), "M")
+                case "deleted":
+                    self.__add(self.to_path(event.src_path), "D")
+                case "moved":
+                    self.__move(
+                        self.to_path(event.src_path), self.to_path(event.dest_path)
+                    )
+                case _:
+                    return None
+
+            if self.timer:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.debounce, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def __add(self, path: str | None, mode: str) -> None:
+        if not path:
+            return None
+
+        change = self.pending.get(path)
+        if not change:
+            self.pending[path] = dict(mode=mode, path=[path])
+            return None
+
+        match change["mode"], mode:
+            case "A", "D":
+                # Created and removed before anyone saw it.
+                del self.pending[path]
+            case "A", _:
+                pass
+            case "D", "A":
+                change["mode"] = "M"
+            case "R", "D":
+                self.pending[path] = dict(mode="D", path=change["path"][:1])
+            case "R", _:
+                pass
+            case _:
+                change["mode"] = mode
+
+    def __move(self, src: str | None, dest: str | None) -> None:
+        if not dest:
+            # Moved away from the posts, e.g. renamed to a backup file.
+            self.__add(src, "D")
+            return None
+
+        if not src:
+            # An editor moved its temp file over the post.
+            self.__add(dest, "M" if self.worktree.joinpath(dest).exists() else "A")
+            return None
+
+        change = self.pending.pop(src, None)
+        if change and change["mode"] == "A":
+            self.pending[dest] = dict(mode="A", path=[dest])
+            return None
+
+        origin = change["path"][0] if change and change["mode"] == "R" else src
+        self.pending[dest] = dict(mode="R", path=[origin, dest])
+
+    def flush(self) -> None:
+        with self.lock:
+            changes = list(self.pending.values())
+            self.pending.clear()
+            self.timer = None
+
+        if changes:
+            self.callback(changes)
+
+
+def watch(
+    app: Flask, debounce: float, report: Callable[[str], None] = logger.info
+) -> None:
+    worktree: Path = OwnerProfile.WORKTREE
+
+    def callback(changes: list[dict]) -> None:
+        start = time.perf_counter()
+        with app.app_context():
+            try:
+                results = apply_changes(changes)
+            finally:
+                db.session.remove()
+
+        elapsed = time.perf_counter() - start
+        for result in results:
+            report(f"{result['status'].capitalize()} {result['path']}.")
+        report(f"Applied {len(results)} changed files in {elapsed:.3f}s.")
+
+    handler = PostEventHandler(worktree, debounce, callback)
+    observer = Observer()
+    observer.schedule(handler, str(PostFile.PATH_ROOT), recursive=True)
+    observer.start()
+    report(f"Watching {PostFile.PATH_ROOT} for changed posts.")
+
+    try:
+        while observer.is_alive():
+            observer.join(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        observer.stop()
+        observer.join()
+        handler.flush()
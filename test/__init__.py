@@ -0,0 +1,7 @@
+import os
+
+# The configuration reads these at import time.
+os.environ.setdefault("GITDIR", "/tmp/myblog-test/gitdir")
+os.environ.setdefault("WORKTREE", "/tmp/myblog-test/worktree")
+os.environ.setdefault("SECRET_KEY", "C_3IbOmd4L15tDuIY78EUYoZBl_wzF2HmDlkz8Yu0BA=")
+os.environ.setdefault("MAIL_PORT", "465")
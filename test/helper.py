@@ -0,0 +1,97 @@
+import tempfile
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import event
+
+from myblog import create_app
+from myblog.flaskexten import db
+from myblog.model.database import Category, Comment, Post, User, transaction
+from myblog.model.fileitem import OwnerProfile, PostFile
+from myblog.model.migration import upgrade
+
+
+class AppTestCase(unittest.TestCase):
+    """Run each test against a fresh in-memory database."""
+
+    def setUp(self):
+        self.app = create_app("testing")
+        self.context = self.app.app_context()
+        self.context.push()
+        upgrade()
+        self.client = self.app.test_client()
+
+        with transaction():
+            self.user = User.create("Owner", "owner@example.com", "password")
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def add_posts(self, count: int, comments: int = 0) -> list[Post]:
+        # Every post gets a category of its own and a few comments.
+        start = Post.query.count()
+        posts: list[Post] = []
+
+        with transaction():
+            for i in range(start, start + count):
+                category = Category.create(f"category {i}", f"category-{i}", "")
+                post = Post.create(
+                    title=f"post {i}",
+                    content=f"<p>Body of post {i}.</p>",
+                    published=True,
+                    slug=f"post-{i}",
+                    meta_title=f"post {i}",
+                    author=self.user,
+                    category=category,
+                )
+                post.published_at = datetime(2023, 1, 1) + timedelta(days=30 * i)
+                post.document = post.to_json()
+                for j in range(comments):
+                    comment = Comment.create(f"comment {j}", post.id)
+                    comment.timestamp = datetime(2023, 12, 1) + timedelta(minutes=j)
+                posts.append(post)
+
+        db.session.expire_all()
+        return posts
+
+    @contextmanager
+    def assertMaxQueries(self, count: int):
+        """Fail if the block runs more than count SQL statements."""
+
+        statements: list[str] = []
+
+        def before_cursor_execute(connection, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+        if len(statements) > count:
+            self.fail(
+                f"{len(statements)} statements were run, expected at most {count}:\n"
+                + "\n".join(statements)
+            )
+
+
+class WorktreeMixin:
+    """Point the worktree of the owner at a temporary directory with posts."""
+
+    def setUp(self):
+        super().setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.saved_worktree = OwnerProfile.WORKTREE, PostFile.PATH_ROOT
+        OwnerProfile.WORKTREE = Path(self.tempdir.name)
+        PostFile.PATH_ROOT = OwnerProfile.WORKTREE.joinpath("post")
+        PostFile.PATH_ROOT.mkdir()
+
+    def tearDown(self):
+        OwnerProfile.WORKTREE, PostFile.PATH_ROOT = self.saved_worktree
+        self.tempdir.cleanup()
+        super().tearDown()
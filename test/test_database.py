@@ -0,0 +1,231 @@
+from unittest import mock
+
+from sqlalchemy import select
+
+from myblog.flaskexten import db
+from myblog.model.database import Category, Comment, Post, recount, transaction
+
+from .helper import AppTestCase
+
+
+class TestCounters(AppTestCase):
+    def assertCounted(self):
+        # Counters kept on write agree with a full recount.
+        with transaction():
+            self.assertEqual(recount(), dict(category=0, post=0, blog=0))
+
+    def test_posts(self):
+        first, second = self.add_posts(2)
+        self.assertEqual(first.category.post_count, 1)
+        self.assertEqual(self.user.blog.published_count, 2)
+
+        with transaction():
+            second.update(
+                title=second.title,
+                content=second.content,
+                published=False,
+                slug=second.slug,
+                meta_title=second.meta_title,
+                author=self.user,
+                category=first.category,
+            )
+        self.assertEqual(self.user.blog.published_count, 1)
+        self.assertCounted()
+
+        with transaction():
+            first.update(
+                title=first.title,
+                content=first.content,
+                published=True,
+                slug=first.slug,
+                meta_title=first.meta_title,
+                author=self.user,
+                category=second.category,
+            )
+        self.assertEqual(second.category.post_count, 1)
+        self.assertCounted()
+
+        with transaction():
+            first.delete()
+        self.assertEqual(self.user.blog.published_count, 0)
+        self.assertCounted()
+
+    def test_category_delete(self):
+        first, second = self.add_posts(2)
+        default = Category.query.first()
+        with transaction():
+            second.category.delete()
+
+        self.assertEqual(default.post_count, 2)
+        self.assertCounted()
+
+    def test_comments(self):
+        post = self.add_posts(1)[0]
+        with transaction():
+            comment = Comment.create("first", post.id)
+            reply = Comment.create("reply", post.id, reply_to_id=comment.id)
+            Comment.create("reply of reply", post.id, reply_to_id=reply.id)
+            Comment.create("second", post.id)
+        self.assertEqual(post.comment_count, 4)
+
+        with transaction():
+            db.session.get(Comment, comment.id).delete()
+        self.assertEqual(db.session.get(Post, post.id).comment_count, 1)
+        self.assertCounted()
+
+    def test_count_by_month(self):
+        posts = self.add_posts(4)
+        with transaction():
+            posts[3].published = False
+
+        # Posts are published 30 days apart from 2023-01-01.
+        self.assertEqual(Post.count_by_month(), [(2023, 1, 2), (2023, 3, 1)])
+
+
+class TestThread(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = self.add_posts(1)[0]
+        with transaction():
+            first = Comment.create("first", self.post.id)
+            second = Comment.create("second", self.post.id)
+            reply = Comment.create("reply", self.post.id, reply_to_id=first.id)
+            Comment.create("reply of reply", self.post.id, reply_to_id=reply.id)
+            Comment.create("another reply", self.post.id, reply_to_id=first.id)
+        db.session.expire_all()
+
+    def test_load_thread(self):
+        post_id = self.post.id
+        with self.assertMaxQueries(1):
+            comments = Comment.load_thread(post_id)
+            contents = [comment.content for comment in comments]
+            first = comments[0]
+            replies = [reply.content for reply in first.reply_me]
+            parent = comments[2].reply_to
+
+        self.assertEqual(
+            contents,
+            ["first", "reply", "reply of reply", "another reply", "second"],
+        )
+        self.assertEqual(replies, ["reply", "another reply"])
+        self.assertIs(parent, comments[1])
+        self.assertEqual([comment.depth for comment in comments], [0, 1, 2, 1, 0])
+
+    def test_delete_thread(self):
+        first = Comment.query.filter_by(content="first").one()
+        with transaction():
+            first.delete()
+
+        remaining = [comment.content for comment in Comment.load_thread(self.post.id)]
+        self.assertEqual(remaining, ["second"])
+        self.assertEqual(db.session.get(Post, self.post.id).comment_count, 1)
+
+    def test_migration_fills_paths(self):
+        from myblog.model.migration import add_comment_paths
+
+        paths = [comment.path for comment in Comment.load_thread(self.post.id)]
+        # The in-memory database has one connection, shared with the session.
+        db.session.close()
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql("UPDATE comment SET path = NULL")
+            add_comment_paths(connection)
+        db.session.expire_all()
+
+        migrated = [comment.path for comment in Comment.load_thread(self.post.id)]
+        self.assertEqual(migrated, paths)
+
+
+class TestDocuments(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = self.add_posts(2)[1]
+        self.slug = self.post.slug
+
+    def get_document(self) -> dict:
+        response = self.client.get(f"/api/read/post/{self.slug}")
+        self.assertEqual(response.mimetype, "application/json")
+        return response.json
+
+    def test_read(self):
+        with self.assertMaxQueries(1):
+            document = self.get_document()
+
+        self.assertEqual(document["title"], self.post.title)
+        self.assertEqual(document["content"], self.post.content)
+        self.assertEqual(document["category"]["title"], self.post.category.title)
+
+    def test_refresh_on_write(self):
+        with transaction():
+            self.post.category.update("renamed", "renamed", "renamed")
+        self.assertEqual(self.get_document()["category"]["title"], "renamed")
+
+        with transaction():
+            self.user.update_information("New Name", "newname")
+        self.assertEqual(self.get_document()["author"]["name"], "New Name")
+
+        with transaction():
+            self.post.category.delete()
+        self.assertEqual(self.get_document()["category"]["title"], "category 0")
+
+    def test_migration_fills_documents(self):
+        from myblog.model.migration import add_post_documents
+
+        document = self.get_document()
+        # The in-memory database has one connection, shared with the session.
+        db.session.close()
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql("UPDATE post SET document = NULL")
+            add_post_documents(connection)
+        db.session.expire_all()
+
+        self.assertEqual(self.get_document(), document)
+
+
+class TestTransaction(AppTestCase):
+    def test_commit_at_outermost(self):
+        commits: list[int] = []
+        with mock.patch.object(db.session, "commit", side_effect=db.session.commit):
+            with transaction():
+                Category.create("outer", "outer", "")
+                with transaction():
+                    Category.create("inner", "inner", "")
+                commits.append(db.session.commit.call_count)
+            commits.append(db.session.commit.call_count)
+
+        self.assertEqual(commits, [0, 1])
+        self.assertEqual(db.session.info["transaction_depth"], 0)
+
+    def test_nested_error_rolls_back_all(self):
+        with self.assertRaises(ValueError), transaction():
+            Category.create("outer", "outer", "")
+            with transaction():
+                Category.create("inner", "inner", "")
+                raise ValueError()
+
+        self.assertEqual(Category.query.count(), 0)
+        self.assertEqual(db.session.info["transaction_depth"], 0)
+
+    def test_caught_nested_error_keeps_outer(self):
+        # Only the failed nested block is rolled back, the outer one decides.
+        with transaction():
+            Category.create("outer", "outer", "")
+            try:
+                with transaction():
+                    Category.create("inner", "inner", "")
+                    db.session.flush()
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        self.assertEqual(db.session.scalars(select(Category.title)).all(), ["outer"])
+
+    def test_outer_error_rolls_back_nested(self):
+        # The nested block writes first and its SAVEPOINT is released.
+        with self.assertRaises(ValueError), transaction():
+            with transaction():
+                Category.create("inner", "inner", "")
+                db.session.flush()
+            Category.create("outer", "outer", "")
+            raise ValueError()
+
+        self.assertEqual(Category.query.count(), 0)
@@ -0,0 +1,44 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from sqlalchemy import create_engine
+
+from myblog.config import Prod
+from myblog.model.engine import apply_pragmas
+
+
+class TestPragmas(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        path = Path(self.tempdir.name).joinpath("data.db")
+        self.engine = create_engine(f"sqlite:///{path}", pool_size=2)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tempdir.cleanup()
+
+    def read(self, connection, name: str):
+        return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+    def test_production_profile(self):
+        apply_pragmas(self.engine, Prod.SQLITE_PRAGMAS)
+
+        # Every pooled connection is tuned, not only the first one.
+        with self.engine.connect() as first, self.engine.connect() as second:
+            for connection in (first, second):
+                self.assertEqual(self.read(connection, "journal_mode"), "wal")
+                self.assertEqual(self.read(connection, "synchronous"), 1)
+                self.assertEqual(self.read(connection, "busy_timeout"), 5000)
+                self.assertEqual(self.read(connection, "cache_size"), -64 * 1024)
+                self.assertEqual(self.read(connection, "temp_store"), 2)
+                self.assertEqual(
+                    self.read(connection, "journal_size_limit"), 64 * 1024 * 1024
+                )
+
+    def test_no_pragmas(self):
+        apply_pragmas(self.engine, {})
+
+        with self.engine.connect() as connection:
+            self.assertEqual(self.read(connection, "journal_mode"), "delete")
+            self.assertEqual(self.read(connection, "synchronous"), 2)
@@ -0,0 +1,58 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from myblog.model.fileitem import PostFile
+
+
+class TestPostFile(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path_root = PostFile.PATH_ROOT
+        PostFile.PATH_ROOT = Path(self.tempdir.name)
+        self.root = PostFile.PATH_ROOT.joinpath("python")
+        self.root.mkdir()
+
+    def tearDown(self):
+        PostFile.PATH_ROOT = self.path_root
+        self.tempdir.cleanup()
+
+    def write(self, name: str, text: str) -> PostFile:
+        path = self.root.joinpath(name)
+        path.write_text(text, encoding="utf-8")
+        return PostFile(path)
+
+    def test_front_matter_and_body(self):
+        post = self.write("hello.md", "---\ncategory: c\n---\n# Hi\n\nA --- B ---\n")
+
+        self.assertEqual(post.metadata, {"category": "c"})
+        self.assertEqual(post.category, "c")
+        self.assertEqual(post.body, "# Hi\n\nA --- B ---")
+
+    def test_without_front_matter(self):
+        post = self.write("plain.md", "Just text.\n")
+
+        self.assertEqual(post.metadata, {})
+        self.assertEqual(post.category, "python")
+        self.assertEqual(post.body, "Just text.")
+
+    def test_same_result_from_text_and_file(self):
+        text = "---\nsummary: s\n---\nbody\n"
+        post = self.write("same.md", text)
+        blob = PostFile(post.path, text=text)
+
+        self.assertEqual(post.metadata, blob.metadata)
+        self.assertEqual(post.body, blob.body)
+
+    def test_memory_mapped_large_file(self):
+        text = "---\ncategory: big\n---\n" + "word " * 1000
+        self.write("big.md", text)
+        PostFile.MMAP_THRESHOLD, threshold = 100, PostFile.MMAP_THRESHOLD
+        try:
+            post = PostFile(self.root.joinpath("big.md"))
+            body = post.body
+        finally:
+            PostFile.MMAP_THRESHOLD = threshold
+
+        self.assertEqual(post.category, "big")
+        self.assertEqual(body, ("word " * 1000).strip())
@@ -0,0 +1,57 @@
+from myblog.model.database import Comment, transaction
+from myblog.utlis import title_to_url
+
+from .helper import AppTestCase
+
+
+class TestConditionalGet(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = self.add_posts(2)[0]
+        self.urls = [
+            f"/read/post/{self.post.id}/{title_to_url(self.post.title)}",
+            f"/api/read/post/{self.post.slug}",
+            "/archive/post",
+            "/rss",
+        ]
+
+    def revalidate(self, url: str, response):
+        return self.client.get(url, headers={"If-None-Match": response.headers["ETag"]})
+
+    def test_not_modified(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertIn("Last-Modified", response.headers)
+
+            # Only the version is read.
+            with self.assertMaxQueries(1):
+                again = self.revalidate(url, response)
+            self.assertEqual(again.status_code, 304, url)
+            self.assertEqual(again.data, b"")
+
+            since = self.client.get(
+                url, headers={"If-Modified-Since": response.headers["Last-Modified"]}
+            )
+            self.assertEqual(since.status_code, 304, url)
+
+    def test_changed_by_comment(self):
+        url = self.urls[0]
+        response = self.client.get(url)
+        with transaction():
+            Comment.create("new", self.post.id)
+
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_changed_by_category(self):
+        responses = {url: self.client.get(url) for url in self.urls}
+        with transaction():
+            self.post.category.update("renamed", "renamed", "renamed")
+
+        for url, response in responses.items():
+            self.assertEqual(self.revalidate(url, response).status_code, 200, url)
+
+    def test_wrong_title_not_found(self):
+        response = self.client.get(self.urls[0])
+        url = f"/read/post/{self.post.id}/wrong-title"
+        self.assertEqual(self.revalidate(url, response).status_code, 404)
@@ -0,0 +1,85 @@
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from myblog.model.gitobject import ZERO_REV, CatFile, diff_name_status
+
+
+class TestGitObject(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.worktree = Path(self.tempdir.name)
+        self.gitdir = self.worktree.joinpath(".git")
+        self.git("init", "-q")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def git(self, *args: str) -> str:
+        return subprocess.check_output(
+            ["git", "-c", "user.name=Owner", "-c", "user.email=owner@example.com"]
+            + ["-C", str(self.worktree), *args],
+            text=True,
+        ).strip()
+
+    def commit(self, files: dict[str, str | None]) -> str:
+        for name, text in files.items():
+            path = self.worktree.joinpath(name)
+            if text is None:
+                path.unlink()
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text(text, encoding="utf-8")
+        self.git("add", "-A")
+        self.git("commit", "-q", "-m", "change")
+        return self.git("rev-parse", "HEAD")
+
+    def test_diff_name_status(self):
+        body = "# Title\n\n" + "A line which git can follow.\n" * 20
+        first = self.commit(
+            {"post/a b.md": body, "post/日记.md": "old\n", "post/gone.md": "bye\n"}
+        )
+        self.assertEqual(
+            diff_name_status(self.gitdir, ZERO_REV, first),
+            [
+                dict(mode="A", path=["post/a b.md"], rev=first),
+                dict(mode="A", path=["post/gone.md"], rev=first),
+                dict(mode="A", path=["post/日记.md"], rev=first),
+            ],
+        )
+
+        second = self.commit(
+            {
+                "post/a b.md": None,
+                "post/new\tname.md": body,
+                "post/日记.md": "new\n",
+                "post/gone.md": None,
+            }
+        )
+        self.assertEqual(
+            diff_name_status(self.gitdir, first, second),
+            [
+                dict(mode="D", path=["post/gone.md"], rev=second),
+                dict(mode="R", path=["post/a b.md", "post/new\tname.md"], rev=second),
+                dict(mode="M", path=["post/日记.md"], rev=second),
+            ],
+        )
+
+        self.assertEqual(diff_name_status(self.gitdir, second, ZERO_REV), [])
+
+    def test_cat_file(self):
+        rev = self.commit({"post/a.md": "first\n\nline\n", "post/b.md": "second"})
+
+        cat_file = CatFile(self.gitdir)
+        try:
+            self.assertEqual(cat_file.read(rev, "post/a.md"), b"first\n\nline\n")
+            self.assertIsNone(cat_file.read(rev, "post/missing file.md"))
+            self.assertIsNone(cat_file.read(rev, "post"))
+            # One process serves every read.
+            process = cat_file.process
+            self.assertEqual(cat_file.read(rev, "post/b.md"), b"second")
+            self.assertIs(cat_file.process, process)
+        finally:
+            cat_file.close()
+        self.assertIsNone(cat_file.process)
@@ -0,0 +1,69 @@
+from unittest import mock
+
+from myblog.ingest import apply_changes, get_render, reindex, walk_posts
+from myblog.model.database import Blog, Post
+from myblog.model.fileitem import PostFile
+
+from .helper import AppTestCase, WorktreeMixin
+
+
+class TestApplyChanges(WorktreeMixin, AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = PostFile.PATH_ROOT.joinpath("python", "hello.md")
+        self.path.parent.mkdir(parents=True)
+
+        self.assertEqual(
+            self.apply("A", "# Hello\n\nFirst line.\nSecond line.\n"), "created"
+        )
+        self.version = Post.query.one().version
+
+    def apply(self, mode: str, text: str) -> str:
+        self.path.write_text(text, encoding="utf-8")
+        results = apply_changes([dict(mode=mode, path=["post/python/hello.md"])])
+        return results[0]["status"]
+
+    def test_whitespace_edit_is_unchanged(self):
+        with mock.patch("myblog.ingest.get_render", wraps=get_render) as render:
+            status = self.apply("M", "# Hello \n\nFirst line.\t\nSecond line.\n")
+
+        self.assertEqual(status, "unchanged")
+        render.assert_not_called()
+        self.assertEqual(Post.query.one().version, self.version)
+
+    def test_line_break_is_a_change(self):
+        status = self.apply("M", "# Hello\n\nFirst line.  \nSecond line.\n")
+
+        self.assertEqual(status, "updated")
+        post = Post.query.one()
+        self.assertIn("<br", post.content)
+        self.assertGreater(post.version, self.version)
+
+    def test_metadata_edit_keeps_render(self):
+        text = "---\nsummary: Greetings.\n---\n# Hello\n\nFirst line.\nSecond line.\n"
+        with mock.patch("myblog.ingest.get_render", wraps=get_render) as render:
+            status = self.apply("M", text)
+
+        self.assertEqual(status, "updated")
+        render.assert_not_called()
+        post = Post.query.one()
+        self.assertEqual(post.summary, "Greetings.")
+        self.assertIn("First line.", post.content)
+
+
+class TestReindex(WorktreeMixin, AppTestCase):
+    def test_unchanged_posts_not_saved(self):
+        for name in ("a", "b", "c"):
+            path = PostFile.PATH_ROOT.joinpath("python", f"{name}.md")
+            path.parent.mkdir(exist_ok=True)
+            path.write_text(f"# {name}\n\nBody.\n", encoding="utf-8")
+        paths = walk_posts(PostFile.PATH_ROOT)
+
+        self.assertEqual(reindex(paths, workers=1), (3, {}))
+        version = Blog.query.one().version
+
+        self.assertEqual(reindex(paths, workers=1), (0, {}))
+        self.assertEqual(Blog.query.one().version, version)
+
+        paths[0].write_text("# a\n\nAnother body.\n", encoding="utf-8")
+        self.assertEqual(reindex(paths, workers=1), (1, {}))
@@ -0,0 +1,193 @@
+import json
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+from sqlalchemy import select
+
+from myblog.flaskexten import db
+from myblog.jobqueue import claim, drain_spool, enqueue
+from myblog.model.database import Job, Task, transaction
+from myblog.utlis import generate_token
+
+from .helper import AppTestCase
+
+
+class TestQueue(AppTestCase):
+    def get_statuses(self, job: Job) -> list[str]:
+        statement = select(Task.status).where(Task.job_id == job.id)
+        return list(db.session.scalars(statement.order_by(Task.id)))
+
+    def test_coalesce_waiting_change(self):
+        first = enqueue([dict(mode="A", path=["a.md"]), dict(mode="A", path=["b.md"])])
+        second = enqueue([dict(mode="M", path=["a.md"])])
+
+        self.assertEqual(self.get_statuses(first), ["coalesced", "pending"])
+        self.assertEqual(self.get_statuses(second), ["pending"])
+
+    def test_coalesce_keeps_rename(self):
+        enqueue([dict(mode="R", path=["old.md", "new.md"])])
+        job = enqueue([dict(mode="M", path=["new.md"])])
+
+        task = job.tasks[0]
+        self.assertEqual(task.mode, "R")
+        self.assertEqual(json.loads(task.path), ["old.md", "new.md"])
+
+    def test_coalesce_rename_then_delete(self):
+        enqueue([dict(mode="R", path=["old.md", "new.md"])])
+        job = enqueue([dict(mode="D", path=["new.md"])])
+
+        # The post is still stored under its old title.
+        task = job.tasks[0]
+        self.assertEqual(task.mode, "D")
+        self.assertEqual(json.loads(task.path), ["old.md"])
+
+        enqueue([dict(mode="A", path=["new.md"])])
+        self.assertEqual(self.get_statuses(job), ["pending"])
+
+    def test_idempotency_key(self):
+        first = enqueue([dict(mode="A", path=["a.md"])], key="push-1")
+        again = enqueue([dict(mode="A", path=["a.md"])], key="push-1")
+
+        self.assertEqual(again.id, first.id)
+        self.assertEqual(Job.query.count(), 1)
+        self.assertEqual(Task.query.count(), 1)
+
+    def test_claim_order(self):
+        enqueue([dict(mode="A", path=["a.md"]), dict(mode="A", path=["b.md"])])
+        self.assertEqual([task.key for task in claim(1)], ["a.md"])
+
+        # A path being applied waits for its running task.
+        enqueue([dict(mode="M", path=["a.md"])])
+        self.assertEqual([task.key for task in claim(10)], ["b.md"])
+        self.assertEqual(claim(10), [])
+
+    def test_requeue_stale_task(self):
+        enqueue([dict(mode="A", path=["a.md"])])
+        task = claim(1)[0]
+        self.assertEqual(claim(1), [])
+
+        # The worker died long ago.
+        timeout = self.app.config["INGEST_LEASE_TIMEOUT"]
+        with transaction():
+            task.claimed_at -= timedelta(seconds=timeout + 1)
+
+        self.assertEqual([task.id for task in claim(1)], [task.id])
+
+
+class TestWorkerStart(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.worker = self.app.extensions["ingest_worker"]
+        self.worker.workers = 2
+
+    def test_start_with_first_request(self):
+        self.app.config["INGEST_START_WORKERS"] = True
+        with mock.patch.object(self.worker, "start") as start:
+            self.app.test_cli_runner().invoke(args=["recount"])
+            start.assert_not_called()
+
+            self.client.get("/rss")
+            start.assert_called_once_with(self.app)
+
+    def test_off_without_flag(self):
+        with mock.patch.object(self.worker, "start") as start:
+            self.client.get("/rss")
+        start.assert_not_called()
+
+
+class TestBatchEndpoint(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        token = generate_token(self.app.config["SECRET_KEY"], b"gaotianchi")
+        self.headers = {"Authorization": f"Bearer {token.decode('utf-8')}"}
+
+    def post(self, payload, key: str = "push-1"):
+        return self.client.post(
+            "/owner/batch/post",
+            json=payload,
+            headers=self.headers | {"Idempotency-Key": key},
+        )
+
+    def test_one_job_per_push(self):
+        changes = [dict(mode="A", path=["a.md"]), dict(mode="M", path=["b.md"])]
+        response = self.post(changes)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json["total"], 2)
+        self.assertEqual(response.json["progress"], dict(pending=2))
+
+        # The hook sends a push again when it did not hear back.
+        self.assertEqual(self.post(changes).json["id"], response.json["id"])
+        job = self.client.get(f"/owner/job/{response.json['id']}", headers=self.headers)
+        self.assertEqual(job.json["status"], response.json["status"])
+        self.assertEqual(Task.query.count(), 2)
+
+    def test_bad_payload(self):
+        self.assertEqual(self.post("a.md").status_code, 400)
+        self.assertEqual(self.post(["a.md"]).status_code, 400)
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_needs_token(self):
+        response = self.client.post("/owner/batch/post", json=[])
+        self.assertEqual(response.status_code, 401)
+
+
+class TestSpool(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.spool = Path(self.directory.name)
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+    def write(self, name: str, record: dict | str) -> None:
+        text = record if isinstance(record, str) else json.dumps(record)
+        self.spool.joinpath(f"{name}.json").write_text(text, encoding="utf-8")
+
+    def get_keys(self) -> list[str]:
+        return list(db.session.scalars(select(Job.idempotency_key).order_by(Job.id)))
+
+    def test_replay_in_order(self):
+        for i in (3, 1, 2):
+            self.write(
+                f"{i}",
+                dict(key=f"push-{i}", payload=[dict(mode="A", path=[f"{i}.md"])]),
+            )
+
+        self.assertEqual(drain_spool(self.spool, 1, 0), 3)
+        self.assertEqual(self.get_keys(), ["push-1", "push-2", "push-3"])
+        self.assertEqual(list(self.spool.glob("*.json")), [])
+
+        # Delivered again, the records add nothing.
+        self.write("1", dict(key="push-1", payload=[dict(mode="A", path=["1.md"])]))
+        self.assertEqual(drain_spool(self.spool, 1, 0), 1)
+        self.assertEqual(Job.query.count(), 3)
+
+    def test_park_poison_records(self):
+        self.write("1", dict(key="push-1", payload=[dict(mode="A", path=["1.md"])]))
+        self.write("2", "{broken")
+        self.write("3", dict(key="push-3", payload=["not a change"]))
+        self.write("4", dict(key="push-4", payload=[dict(mode="A", path=["4.md"])]))
+
+        self.assertEqual(drain_spool(self.spool, 1, 0), 2)
+        self.assertEqual(self.get_keys(), ["push-1", "push-4"])
+        self.assertEqual(
+            sorted(path.name for path in self.spool.joinpath("dead").iterdir()),
+            ["2.json", "3.json"],
+        )
+
+    def test_stop_at_transient_failure(self):
+        self.write("1", dict(key="push-1", payload=[dict(mode="A", path=["1.md"])]))
+        self.write("2", dict(key="push-2", payload=[dict(mode="A", path=["2.md"])]))
+
+        with mock.patch("myblog.jobqueue.enqueue", side_effect=OSError("locked")):
+            self.assertEqual(drain_spool(self.spool, 2, 0), 0)
+
+        # Nothing was parked or skipped, the next drain picks it up.
+        self.assertEqual(len(list(self.spool.glob("*.json"))), 2)
+        self.assertEqual(drain_spool(self.spool, 1, 0), 2)
+        self.assertEqual(self.get_keys(), ["push-1", "push-2"])
@@ -0,0 +1,56 @@
+from myblog.manifest import sync
+from myblog.model.database import Comment, ManifestEntry, Post, transaction
+from myblog.model.fileitem import PostFile
+
+from .helper import AppTestCase, WorktreeMixin
+
+
+class TestSync(WorktreeMixin, AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = PostFile.PATH_ROOT.joinpath("python")
+        self.root.mkdir()
+
+        self.root.joinpath("hello.md").write_text("# Hello\n", encoding="utf-8")
+        sync()
+        self.post = Post.query.filter_by(title="hello").one()
+        with transaction():
+            Comment.create("first", self.post.id)
+
+    def test_rename_keeps_post(self):
+        self.root.joinpath("hello.md").rename(self.root.joinpath("hi.md"))
+        report = sync()
+
+        self.assertEqual(report["renamed"], 1)
+        self.assertEqual(report["removed"], 0)
+        post = Post.query.one()
+        self.assertEqual((post.id, post.title), (self.post.id, "hi"))
+        self.assertEqual([comment.content for comment in post.comments], ["first"])
+
+        self.assertEqual(sync()["changed"], 0)
+
+    def test_delete_needs_prune(self):
+        self.root.joinpath("hello.md").unlink()
+
+        report = sync()
+        self.assertEqual(report["missing"], ["post/python/hello.md"])
+        self.assertEqual(report["removed"], 0)
+        self.assertEqual(Post.query.count(), 1)
+
+        report = sync(prune=True)
+        self.assertEqual(report["removed"], 1)
+        self.assertEqual(Post.query.count(), 0)
+
+    def test_reingest_lost_post(self):
+        # Deleted behind the back of the manifest, e.g. from the owner's page.
+        with transaction():
+            self.post.delete()
+
+        report = sync()
+        self.assertEqual(report["changed"], 1)
+        self.assertEqual(report["orphans"], [])
+        post = Post.query.one()
+        self.assertEqual(post.title, "hello")
+        self.assertEqual(ManifestEntry.query.one().post_id, post.id)
+
+        self.assertEqual(sync()["changed"], 0)
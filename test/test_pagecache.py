@@ -0,0 +1,119 @@
+import tempfile
+from pathlib import Path
+
+from myblog.flaskexten import db
+from myblog.model.database import Comment, Post, transaction
+from myblog.pagecache import PageCache
+from myblog.utlis import title_to_url
+
+from .helper import AppTestCase
+
+
+class TestPageCache(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name).joinpath("page-cache.db")
+        self.app.extensions["page_cache"] = PageCache(16, self.path)
+
+        self.post = self.add_posts(2)[0]
+        self.url = f"/read/post/{self.post.id}/{title_to_url(self.post.title)}"
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+    def get(self, url: str, count: int):
+        with self.assertMaxQueries(count):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_hit_skips_database(self):
+        for url in [self.url, "/archive/post", "/archive/post?sort_by=oldest", "/rss"]:
+            first = self.client.get(url)
+            again = self.get(url, 0)
+            self.assertEqual(again.data, first.data)
+            self.assertEqual(again.headers["ETag"], first.headers["ETag"])
+
+        # The order of arguments does not matter.
+        self.get("/archive/post?sort_by=oldest&category=", 0)
+
+    def test_hit_is_conditional(self):
+        first = self.client.get(self.url)
+        response = self.client.get(
+            self.url, headers={"If-None-Match": first.headers["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_comment_invalidates_post(self):
+        self.client.get(self.url)
+        self.client.get("/archive/post")
+        with transaction():
+            Comment.create("new comment", self.post.id)
+
+        self.assertIn("new comment", self.get(self.url, 3).text)
+        self.get("/archive/post", 0)
+
+    def test_publish_invalidates_lists(self):
+        self.client.get("/archive/post")
+        self.client.get(self.url)
+        self.add_posts(1)
+
+        self.assertIn("post 2", self.get("/archive/post", 4).text)
+        self.get(self.url, 0)
+
+    def test_delete_invalidates_post(self):
+        self.client.get(self.url)
+        with transaction():
+            db.session.get(Post, self.post.id).delete()
+
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_shared_between_processes(self):
+        self.client.get(self.url)
+
+        # Another process sees the page, and the writes of this one.
+        other = PageCache(16, self.path)
+        self.app.extensions["page_cache"] = other
+        self.get(self.url, 0)
+
+        with transaction():
+            Comment.create("new comment", self.post.id)
+        self.app.extensions["page_cache"] = PageCache(16, self.path)
+        self.get(self.url, 3)
+
+    def test_rollback_keeps_pages(self):
+        self.client.get(self.url)
+        with self.assertRaises(RuntimeError), transaction():
+            Comment.create("rolled back", self.post.id)
+            raise RuntimeError()
+
+        self.get(self.url, 0)
+
+
+def get_sidebar(text: str) -> str:
+    return text[text.index('id="archive-metadata"') :]
+
+
+class TestFragments(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.extensions["page_cache"] = PageCache(16)
+        self.add_posts(3)
+
+    def test_sidebar_is_shared(self):
+        # Other pages of the archive only query their own posts.
+        first = self.client.get("/archive/post")
+        with self.assertMaxQueries(2) as statements:
+            second = self.client.get("/archive/post?sort_by=oldest")
+        self.assertFalse(any("FROM category" in sql for sql in statements))
+        self.assertEqual(get_sidebar(second.text), get_sidebar(first.text))
+
+    def test_write_bumps_stamp(self):
+        self.client.get("/archive/post")
+        self.add_posts(1)
+
+        response = self.client.get("/archive/post?sort_by=oldest")
+        self.assertIn("category 3", response.text)
+        self.assertIn("2023-04-01", response.text)
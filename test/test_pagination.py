@@ -0,0 +1,132 @@
+from myblog.model.database import Post
+from myblog.model.pagination import decode_cursor, encode_cursor, paginate
+from myblog.utlis import generate_token
+
+from .helper import AppTestCase
+
+
+class TestPaginate(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_posts(7)
+        self.keys = (Post.published_at, Post.id)
+
+    def walk(self, direction: str, cursor: str | None, descending: bool) -> list:
+        pages = []
+        while True:
+            page = paginate(Post.query, self.keys, 3, cursor, descending)
+            pages.append([post.title for post in page])
+            cursor = getattr(page, direction)
+            if not cursor:
+                return pages
+
+    def test_walk_forward_and_back(self):
+        pages = self.walk("next", None, descending=True)
+        self.assertEqual(
+            pages,
+            [
+                ["post 6", "post 5", "post 4"],
+                ["post 3", "post 2", "post 1"],
+                ["post 0"],
+            ],
+        )
+
+        last = paginate(Post.query, self.keys, 3, None)
+        last = paginate(Post.query, self.keys, 3, last.next)
+        last = paginate(Post.query, self.keys, 3, last.next)
+        self.assertIsNone(last.next)
+        back = self.walk("prev", last.prev, descending=True)
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_ascending(self):
+        pages = self.walk("next", None, descending=False)
+        self.assertEqual(pages[0], ["post 0", "post 1", "post 2"])
+        self.assertEqual(pages[-1], ["post 6"])
+
+    def test_cursor(self):
+        post = Post.query.first()
+        cursor = encode_cursor("next", (post.published_at, post.id))
+        self.assertEqual(
+            decode_cursor(cursor, self.keys), ("next", (post.published_at, post.id))
+        )
+
+        for invalid in [
+            "",
+            "x",
+            encode_cursor("up", (1, 1)),
+            encode_cursor("next", (1,)),
+        ]:
+            with self.assertRaises(ValueError):
+                decode_cursor(invalid, self.keys)
+
+    def test_deep_page_cost(self):
+        # A deep page seeks past the cursor instead of skipping rows.
+        first = paginate(Post.query, self.keys, 2)
+        with self.assertMaxQueries(1) as statements:
+            page = paginate(Post.query, self.keys, 2, first.next)
+            [post.title for post in page]
+        self.assertIn("(post.published_at, post.id) < (?, ?)", statements[0])
+
+
+class TestPageViews(AppTestCase):
+    def test_manage_comment(self):
+        self.add_posts(1, comments=15)
+        token = generate_token(self.app.config["SECRET_KEY"], b"gaotianchi")
+        with self.client.session_transaction() as session:
+            session["token"] = token.decode("utf-8")
+
+        first = self.client.get("/owner/manage/comment")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.text.count("owner/delete/comment"), 10)
+
+        self.assertEqual(
+            self.client.get("/owner/manage/comment?cursor=x").status_code, 400
+        )
+
+    def test_archive_keeps_filters(self):
+        self.app.config["POST_PER_PAGE"] = 2
+        self.add_posts(5)
+        response = self.client.get("/archive/post?sort_by=oldest")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("sort_by=oldest", response.text)
+        self.assertIn("post 1", response.text)
+        self.assertNotIn("post 2</h4>", response.text)
+
+    def test_api_posts(self):
+        self.app.config["POST_PER_PAGE"] = 2
+        self.add_posts(3)
+        first = self.client.get("/api/posts").json
+        self.assertEqual(
+            [item["title"] for item in first["items"]], ["post 2", "post 1"]
+        )
+        self.assertIsNone(first["prev"])
+
+        second = self.client.get(f"/api/posts?cursor={first['next']}").json
+        self.assertEqual([item["title"] for item in second["items"]], ["post 0"])
+        self.assertIsNone(second["next"])
+
+    def test_api_comments(self):
+        post = self.add_posts(1, comments=12)[0]
+        first = self.client.get(f"/api/read/post/{post.slug}/comments").json
+        self.assertEqual(len(first["items"]), 10)
+        second = self.client.get(
+            f"/api/read/post/{post.slug}/comments?cursor={first['next']}"
+        ).json
+        self.assertEqual(
+            [item["content"] for item in second["items"]], ["comment 10", "comment 11"]
+        )
+
+        # A post titled "comments" still gets its page.
+        response = self.client.get(f"/read/post/{post.id}/comments")
+        self.assertEqual(response.mimetype, "text/html")
+
+    def test_api_old_urls(self):
+        post = self.add_posts(1)[0]
+
+        response = self.client.get(f"/read/post/{post.slug}")
+        self.assertEqual(response.status_code, 308)
+        self.assertEqual(response.location, f"/api/read/post/{post.slug}")
+
+        response = self.client.get(f"/read/post/{post.slug}", follow_redirects=True)
+        self.assertEqual(response.json["title"], post.title)
+        self.assertEqual(self.client.get("/example").location, "/api/example")
@@ -0,0 +1,68 @@
+from myblog.utlis import title_to_url
+
+from .helper import AppTestCase
+
+
+class TestQueryCount(AppTestCase):
+    def get(self, url: str, count: int) -> list[str]:
+        with self.assertMaxQueries(count) as statements:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return statements
+
+    def test_archive(self):
+        self.add_posts(2)
+        few = self.get("/archive/post", 4)
+        self.add_posts(20)
+        many = self.get("/archive/post", 4)
+
+        self.assertEqual(len(few), len(many))
+
+    def test_archive_of_category(self):
+        self.add_posts(5)
+        self.get(f"/archive/post?category={title_to_url('category 1')}", 5)
+
+    def test_rss(self):
+        self.add_posts(2)
+        few = self.get("/rss", 2)
+        self.add_posts(20)
+        many = self.get("/rss", 2)
+
+        self.assertEqual(len(few), len(many))
+
+    def test_read_post(self):
+        post = self.add_posts(1, comments=20)[0]
+        url = f"/read/post/{post.id}/{title_to_url(post.title)}"
+
+        # The version of the post, the post and its comments.
+        statements = self.get(url, 3)
+        self.assertEqual(len(statements), 3)
+
+    def test_lists_skip_bodies(self):
+        post = self.add_posts(3)[0]
+        for url in ["/archive/post", "/rss", "/api/posts"]:
+            statements = self.get(url, 4)
+            self.assertFalse(
+                any("post.content" in statement for statement in statements), url
+            )
+
+        statements = self.get(f"/read/post/{post.id}/{title_to_url(post.title)}", 3)
+        self.assertIn("post.content", statements[1])
+
+
+class TestQueryPlan(AppTestCase):
+    def test_explain_strict(self):
+        self.add_posts(3, comments=2)
+
+        result = self.app.test_cli_runner().invoke(args=["explain", "--strict"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("SEARCH post USING INDEX ix_post_published_at", result.output)
+        self.assertIn("0 slow steps.", result.output)
+
+    def test_capture_skips_page_cache(self):
+        from myblog.queryplan import capture, get_workloads
+
+        self.add_posts(1)
+        work = get_workloads()["visitor.rss"]
+        self.assertTrue(capture(self.app, work))
+        self.assertTrue(capture(self.app, work))
@@ -0,0 +1,77 @@
+import sqlite3
+import tempfile
+import unittest
+from contextlib import closing
+from pathlib import Path
+
+from myblog import create_app
+from myblog.model.render import Post, RenderCache, get_render_cache, init_app
+
+from .helper import AppTestCase
+
+
+class Item:
+    def __init__(self, body: str) -> None:
+        self.body = body
+
+
+class TestRenderCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tempdir.name).joinpath("render-cache.db")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_hit_after_miss(self):
+        cache = RenderCache(self.path, max_size=1024 * 1024)
+        render = Post(cache=cache)
+
+        first = render(Item("## Title\n\nSome *text*."))
+        second = Post(cache=cache)(Item("## Title\n\nSome *text*."))
+
+        self.assertEqual(first.html, second.html)
+        self.assertEqual(first.toc, second.toc)
+        self.assertIsNotNone(second.toc)
+        stats = cache.stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = RenderCache(self.path, max_size=10)
+        cache.set("a", "aaaa", None)
+        cache.set("b", "bbbb", None)
+        cache.get("a")
+        cache.set("c", "cccc", None)
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_hits_written_in_batches(self):
+        cache = RenderCache(self.path, max_size=1024 * 1024)
+        cache.set("a", "aaaa", None)
+        for _ in range(cache.FLUSH_EVERY - 1):
+            cache.get("a")
+
+        def get_written() -> dict:
+            with closing(sqlite3.connect(self.path)) as conn:
+                rows = conn.execute("SELECT name, value FROM stats").fetchall()
+            return dict(rows)
+
+        self.assertEqual(get_written(), {})
+        cache.get("a")
+        self.assertEqual(get_written(), dict(hits=cache.FLUSH_EVERY))
+
+
+class TestRenderCacheOfApp(AppTestCase):
+    def test_follows_app_config(self):
+        self.assertIsNone(get_render_cache())
+
+        app = create_app("testing")
+        app.config.update(RENDER_CACHE_ENABLED=True)
+        with tempfile.TemporaryDirectory() as directory:
+            app.config["PATH_RENDER_CACHE"] = Path(directory).joinpath("render.db")
+            init_app(app)
+            with app.app_context():
+                self.assertEqual(get_render_cache().path.parent, Path(directory))
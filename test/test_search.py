@@ -0,0 +1,80 @@
+from myblog.flaskexten import db
+from myblog.model.database import Post, search_posts, transaction
+
+from .helper import AppTestCase
+
+
+class TestSearch(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.posts = self.add_posts(3)
+
+    def search(self, terms: str) -> list[str]:
+        return [result["title"] for result in search_posts(terms, 1, 10)[0]]
+
+    def edit(self, post: Post, content: str, published: bool = True) -> None:
+        with transaction():
+            post.update(
+                title=post.title,
+                content=content,
+                published=published,
+                slug=post.slug,
+                meta_title=post.meta_title,
+                author=self.user,
+                category=post.category,
+            )
+
+    def test_index_follows_writes(self):
+        self.assertEqual(self.search("post 1"), ["post 1"])
+
+        self.edit(self.posts[1], "<p>About <em>lighthouses</em>.</p>")
+        self.assertEqual(self.search("lighthouses"), ["post 1"])
+        self.assertEqual(self.search("body of post 1"), [])
+
+        self.edit(self.posts[1], "<p>About lighthouses.</p>", published=False)
+        self.assertEqual(self.search("lighthouses"), [])
+
+        with transaction():
+            self.posts[2].delete()
+        self.assertEqual(self.search("post 2"), [])
+
+    def test_rollback_keeps_index(self):
+        with self.assertRaises(RuntimeError), transaction():
+            self.posts[0].delete()
+            raise RuntimeError()
+
+        self.assertEqual(self.search("post 0"), ["post 0"])
+
+    def test_ranking_and_snippets(self):
+        self.edit(self.posts[0], "<p>Lighthouses &amp; <b>lamps</b> &lt;br&gt;</p>")
+        self.edit(self.posts[2], "<p>Lamps, lamps and more lamps.</p>")
+
+        results = search_posts("lamps", 1, 10)[0]
+        self.assertEqual([result["title"] for result in results], ["post 2", "post 0"])
+        self.assertEqual(
+            results[1]["snippet"],
+            "Lighthouses &amp; <mark>lamps</mark> &lt;br&gt;",
+        )
+
+        # Query syntax is searched as text.
+        self.assertEqual(self.search('lamps OR "post'), [])
+
+    def test_rebuild(self):
+        from myblog.model.migration import add_post_search
+
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql("DROP TABLE post_search")
+            add_post_search(connection)
+
+        self.assertEqual(sorted(self.search("body")), ["post 0", "post 1", "post 2"])
+
+    def test_search_page(self):
+        self.app.config["POST_PER_PAGE"] = 2
+        with self.assertMaxQueries(1):
+            first = self.client.get("/search?q=body")
+        self.assertEqual(first.text.count("<mark>"), 2)
+        self.assertIn("page=2", first.text)
+
+        second = self.client.get("/search?q=body&page=2")
+        self.assertEqual(second.text.count("<mark>"), 1)
+        self.assertEqual(self.client.get("/search?q=body&page=0").status_code, 400)
@@ -0,0 +1,98 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from watchdog.events import (
+    DirModifiedEvent,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+)
+
+from myblog.watcher import PostEventHandler
+
+
+class TestPostEventHandler(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.worktree = Path(self.tempdir.name)
+        self.flushed: list[list[dict]] = []
+        self.done = threading.Event()
+        self.handler = PostEventHandler(self.worktree, 60, self.callback)
+
+    def tearDown(self):
+        if self.handler.timer:
+            self.handler.timer.cancel()
+        self.tempdir.cleanup()
+
+    def callback(self, changes: list[dict]) -> None:
+        self.flushed.append(changes)
+        self.done.set()
+
+    def path(self, name: str) -> str:
+        return str(self.worktree.joinpath("post", name))
+
+    def send(self, *events) -> list[dict]:
+        for event in events:
+            self.handler.on_any_event(event)
+        self.handler.flush()
+        return self.flushed.pop() if self.flushed else []
+
+    def test_burst_is_one_change(self):
+        changes = self.send(
+            FileModifiedEvent(self.path("a.md")),
+            FileModifiedEvent(self.path("a.md")),
+            FileModifiedEvent(self.path("a.md")),
+            DirModifiedEvent(str(self.worktree.joinpath("post"))),
+            FileModifiedEvent(self.path("a.txt")),
+        )
+        self.assertEqual(changes, [dict(mode="M", path=["post/a.md"])])
+
+    def test_coalesce_modes(self):
+        changes = self.send(
+            # Created and removed before the flush.
+            FileCreatedEvent(self.path("a.md")),
+            FileModifiedEvent(self.path("a.md")),
+            FileDeletedEvent(self.path("a.md")),
+            # Removed and created again.
+            FileDeletedEvent(self.path("b.md")),
+            FileCreatedEvent(self.path("b.md")),
+            # New, then moved before the flush.
+            FileCreatedEvent(self.path("c.md")),
+            FileMovedEvent(self.path("c.md"), self.path("d.md")),
+        )
+        self.assertEqual(
+            changes,
+            [dict(mode="M", path=["post/b.md"]), dict(mode="A", path=["post/d.md"])],
+        )
+
+    def test_moves(self):
+        changes = self.send(
+            # Renamed twice keeps the first name.
+            FileMovedEvent(self.path("a.md"), self.path("b.md")),
+            FileMovedEvent(self.path("b.md"), self.path("c.md")),
+            FileModifiedEvent(self.path("c.md")),
+            # An editor replaced the post with its temp file.
+            FileMovedEvent(self.path("d.md.swp"), self.path("d.md")),
+            # Moved away from the posts.
+            FileMovedEvent(self.path("e.md"), self.path("e.md.bak")),
+        )
+        self.assertEqual(
+            changes,
+            [
+                dict(mode="R", path=["post/a.md", "post/c.md"]),
+                dict(mode="A", path=["post/d.md"]),
+                dict(mode="D", path=["post/e.md"]),
+            ],
+        )
+
+    def test_flush_after_quiet_period(self):
+        self.handler.debounce = 0.05
+        self.handler.on_any_event(FileModifiedEvent(self.path("a.md")))
+        self.handler.on_any_event(FileModifiedEvent(self.path("b.md")))
+
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(len(self.flushed), 1)
+        self.assertEqual(len(self.flushed[0]), 2)